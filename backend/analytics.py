@@ -0,0 +1,282 @@
+# Cohort comparison and semester-over-semester trend analytics.
+# Loaded on first use by server.py; see FEATURE_ROUTERS there.
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
+from pymongo.errors import DuplicateKeyError
+from typing import Dict, List, Optional
+from datetime import datetime, timedelta
+import asyncio
+import logging
+import os
+import uuid
+
+from server import RESULTS_STORAGE, db
+
+router = APIRouter(prefix="/api")
+logger = logging.getLogger(__name__)
+
+# Cached stats older than this are recomputed even without an invalidation,
+# bounding staleness from writes that do not invalidate (deletes, stream moves)
+ANALYTICS_CACHE_TTL = int(os.environ.get("ANALYTICS_CACHE_TTL", "900"))
+# Recomputations touching more student-semesters than this run as background jobs
+ANALYTICS_INLINE_LIMIT = int(os.environ.get("ANALYTICS_INLINE_LIMIT", "2000"))
+# Subjects record whether they passed under the scheme that graded them; results
+# graded before that was recorded fall back to counting these grades as fails
+FAILING_GRADES = {grade.strip() for grade in os.environ.get("ANALYTICS_FAILING_GRADES", "F").split(",")}
+MARK_BUCKET_SIZE = 10
+# A running job refreshes claimed_at after every semester; one not refreshed for
+# this many seconds (e.g. its server restarted) is taken over by the next request
+ANALYTICS_JOB_LEASE = int(os.environ.get("ANALYTICS_JOB_LEASE", "300"))
+
+class AnalyticsJob(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    stream: str
+    semesters: List[str]
+    status: str = "pending"  # pending, running, done, failed
+    completed: int = 0
+    error: Optional[str] = None
+    requested_by: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    claimed_at: datetime = Field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+
+# Background jobs keep a reference here so they are not garbage collected mid-run
+_running_jobs = set()
+
+# Aggregation
+# Marks are integers in 0-100, so grouping by (subject, marks, failed) yields a
+# small frequency table per subject from which the mean, exact median, pass
+# rate and distribution are all derived without pulling raw results.
+def subject_marks_group(prefix: str) -> dict:
+    return {"$group": {
+        "_id": {
+            "subject": f"${prefix}.name",
+            "marks": f"${prefix}.marks",
+            "failed": {"$eq": [
+                {"$ifNull": [
+                    f"${prefix}.passed",
+                    {"$cond": [{"$in": [f"${prefix}.grade", list(FAILING_GRADES)]}, False, True]}
+                ]},
+                False
+            ]}
+        },
+        "count": {"$sum": 1}
+    }}
+
+async def semester_mark_counts(stream: str, semester: str) -> List[dict]:
+    student_filter = {"stream": stream, "deleted": False, "semester_results.semester": semester}
+    rows = []
+    if RESULTS_STORAGE == "collection":
+        student_ids = await db.students.distinct("id", {"stream": stream, "deleted": False})
+        rows += await db.results.aggregate([
+            {"$match": {"student_id": {"$in": student_ids}, "semester": semester}},
+            {"$unwind": "$subjects"},
+            subject_marks_group("subjects"),
+        ]).to_list(None)
+        # Older students may still embed this semester; skip those already counted
+        moved = await db.results.distinct("student_id", {"student_id": {"$in": student_ids}, "semester": semester})
+        student_filter["id"] = {"$nin": moved}
+    
+    rows += await db.students.aggregate([
+        {"$match": student_filter},
+        {"$project": {"_id": 0, "semester_results": 1}},
+        {"$unwind": "$semester_results"},
+        {"$match": {"semester_results.semester": semester}},
+        {"$unwind": "$semester_results.subjects"},
+        subject_marks_group("semester_results.subjects"),
+    ]).to_list(None)
+    return rows
+
+def median(counts: Dict[int, int], total: int) -> float:
+    # Average of the middle one or two marks, walking the sorted frequency table
+    middle = [(total - 1) // 2, total // 2]
+    values = []
+    seen = 0
+    for marks in sorted(counts):
+        seen += counts[marks]
+        while middle and middle[0] < seen:
+            values.append(marks)
+            middle.pop(0)
+    return sum(values) / len(values)
+
+def summarize_semester(rows: List[dict]) -> List[dict]:
+    by_subject: Dict[str, dict] = {}
+    for row in rows:
+        key = row["_id"]
+        subject = by_subject.setdefault(key["subject"], {"counts": {}, "failed": 0})
+        subject["counts"][key["marks"]] = subject["counts"].get(key["marks"], 0) + row["count"]
+        if key["failed"]:
+            subject["failed"] += row["count"]
+    
+    # A list rather than a dict keyed by subject, since subject names are free
+    # text and not safe as Mongo field names
+    stats = []
+    buckets = 100 // MARK_BUCKET_SIZE
+    for name, subject in sorted(by_subject.items()):
+        counts = subject["counts"]
+        total = sum(counts.values())
+        distribution = [0] * buckets
+        for marks, count in counts.items():
+            distribution[min(max(marks, 0) // MARK_BUCKET_SIZE, buckets - 1)] += count
+        stats.append({
+            "subject": name,
+            "students": total,
+            "mean": round(sum(marks * count for marks, count in counts.items()) / total, 2),
+            "median": median(counts, total),
+            "pass_rate": round(1 - subject["failed"] / total, 4),
+            "distribution": [round(count / total, 4) for count in distribution],
+        })
+    return stats
+
+def semester_shift(previous: List[dict], current: List[dict]) -> List[dict]:
+    # Subjects present in both semesters; distribution_shift is the total
+    # variation distance between the two mark distributions (0 = same, 1 = disjoint)
+    before_by_subject = {stats["subject"]: stats for stats in previous}
+    shifts = []
+    for after in current:
+        before = before_by_subject.get(after["subject"])
+        if before is None:
+            continue
+        shifts.append({
+            "subject": after["subject"],
+            "mean_change": round(after["mean"] - before["mean"], 2),
+            "median_change": after["median"] - before["median"],
+            "pass_rate_change": round(after["pass_rate"] - before["pass_rate"], 4),
+            "distribution_shift": round(
+                sum(abs(a - b) for a, b in zip(after["distribution"], before["distribution"])) / 2, 4
+            ),
+        })
+    return shifts
+
+# Cache
+async def compute_semester_stats(stream: str, semester: str) -> List[dict]:
+    entry = await db.analytics_cache.find_one({"stream": stream, "semester": semester}, {"generation": 1})
+    generation = entry["generation"] if entry else 0
+    stats = summarize_semester(await semester_mark_counts(stream, semester))
+    
+    # Only store if nothing invalidated this semester while it was being computed
+    try:
+        await db.analytics_cache.update_one(
+            {"stream": stream, "semester": semester, "generation": generation},
+            {"$set": {"stats": stats, "computed_at": datetime.utcnow()}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        pass
+    return stats
+
+async def cached_semester_stats(stream: str, semesters: List[str]) -> Dict[str, List[dict]]:
+    fresh_after = datetime.utcnow() - timedelta(seconds=ANALYTICS_CACHE_TTL)
+    entries = db.analytics_cache.find({
+        "stream": stream,
+        "semester": {"$in": semesters},
+        "stats": {"$exists": True},
+        "computed_at": {"$gte": fresh_after}
+    })
+    return {entry["semester"]: entry["stats"] async for entry in entries}
+
+async def stream_semesters(stream: str) -> List[str]:
+    student_filter = {"stream": stream, "deleted": False}
+    semesters = set(await db.students.distinct("semester_results.semester", student_filter))
+    if RESULTS_STORAGE == "collection":
+        student_ids = await db.students.distinct("id", student_filter)
+        semesters.update(await db.results.distinct("semester", {"student_id": {"$in": student_ids}}))
+    return sorted(semesters, key=semester_sort_key)
+
+def semester_sort_key(semester: str):
+    return (0, int(semester), "") if semester.isdigit() else (1, 0, semester)
+
+def build_trends(stream: str, semesters: List[str], stats: Dict[str, List[dict]]) -> dict:
+    return {
+        "stream": stream,
+        "semesters": [{"semester": semester, "subjects": stats[semester]} for semester in semesters],
+        "shifts": [
+            {"from": previous, "to": current, "subjects": semester_shift(stats[previous], stats[current])}
+            for previous, current in zip(semesters, semesters[1:])
+        ],
+    }
+
+# Background jobs
+# The worker running a job is identified by an `owner` token stored on the job;
+# once another request takes a stale job over, the previous worker's updates
+# match nothing and it stops.
+async def run_analytics_job(job: AnalyticsJob, owner: str):
+    async def update_job(update: dict) -> bool:
+        result = await db.analytics_jobs.update_one({"id": job.id, "owner": owner}, update)
+        return result.matched_count == 1
+    
+    if not await update_job({"$set": {"status": "running", "claimed_at": datetime.utcnow()}}):
+        return
+    try:
+        for semester in job.semesters:
+            await compute_semester_stats(job.stream, semester)
+            if not await update_job({"$inc": {"completed": 1}, "$set": {"claimed_at": datetime.utcnow()}}):
+                return
+    except Exception as e:
+        logger.exception("Analytics job %s failed", job.id)
+        await update_job({"$set": {"status": "failed", "error": str(e), "finished_at": datetime.utcnow()}})
+        return
+    await update_job({"$set": {"status": "done", "finished_at": datetime.utcnow()}})
+
+async def start_analytics_job(stream: str, semesters: List[str], user_email: str) -> AnalyticsJob:
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=ANALYTICS_JOB_LEASE)
+    active_filter = {"stream": stream, "semesters": semesters, "status": {"$in": ["pending", "running"]}}
+    
+    # Reuse a job still working on the same recomputation
+    existing = await db.analytics_jobs.find_one(
+        {**active_filter, "claimed_at": {"$gte": stale_before}},
+        {"_id": 0, "owner": 0}
+    )
+    if existing:
+        return AnalyticsJob(**existing)
+    
+    # Take over one whose worker stopped refreshing its claim, or start a new one
+    owner = str(uuid.uuid4())
+    claim = {"status": "pending", "completed": 0, "claimed_at": now}
+    stale = await db.analytics_jobs.find_one_and_update(
+        {**active_filter, "$or": [{"claimed_at": {"$lt": stale_before}}, {"claimed_at": {"$exists": False}}]},
+        {"$set": {**claim, "owner": owner}},
+        projection={"_id": 0, "owner": 0}
+    )
+    if stale:
+        job = AnalyticsJob(**{**stale, **claim})
+    else:
+        job = AnalyticsJob(stream=stream, semesters=semesters, requested_by=user_email, claimed_at=now)
+        await db.analytics_jobs.insert_one({**job.dict(), "owner": owner})
+    task = asyncio.create_task(run_analytics_job(job, owner))
+    _running_jobs.add(task)
+    task.add_done_callback(_running_jobs.discard)
+    return job
+
+# Routes
+@router.get("/analytics/trends")
+async def get_stream_trends(stream: str, semesters: Optional[List[str]] = Query(None), user_email: str = None):
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    semesters = sorted(set(semesters), key=semester_sort_key) if semesters else await stream_semesters(stream)
+    stats = await cached_semester_stats(stream, semesters)
+    missing = [semester for semester in semesters if semester not in stats]
+    if missing:
+        cohort_size = await db.students.count_documents({"stream": stream, "deleted": False})
+        if cohort_size * len(missing) > ANALYTICS_INLINE_LIMIT:
+            job = await start_analytics_job(stream, missing, user_email)
+            return JSONResponse(status_code=202, content=jsonable_encoder(job))
+        computed = await asyncio.gather(*(compute_semester_stats(stream, semester) for semester in missing))
+        stats.update(zip(missing, computed))
+    
+    return build_trends(stream, semesters, stats)
+
+@router.get("/analytics/jobs/{job_id}")
+async def get_analytics_job(job_id: str, user_email: str = None):
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    job = await db.analytics_jobs.find_one({"id": job_id}, {"_id": 0, "owner": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Analytics job not found")
+    
+    return AnalyticsJob(**job)
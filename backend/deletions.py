@@ -0,0 +1,196 @@
+# Bulk soft deletes, deletion progress and undo.
+# Loaded on first use by server.py; see FEATURE_ROUTERS there.
+from fastapi import APIRouter, HTTPException, Depends
+from pydantic import BaseModel
+from typing import List, Optional
+from datetime import datetime
+import re
+
+from server import (
+    ActivityLog,
+    create_deletion_job,
+    dashboard,
+    db,
+    deletion_marker,
+    DeletionJob,
+    limit_writes,
+    log_activity,
+    set_deletion_total,
+    _user_count_cache,
+)
+
+router = APIRouter(prefix="/api")
+
+# Field that must stay unique among live documents when a deletion is undone
+RESTORE_UNIQUE_FIELDS = {"students": "roll_number", "users": "email"}
+
+class StudentBulkDelete(BaseModel):
+    stream: Optional[str] = None
+    semester: Optional[str] = None
+    roll_numbers: Optional[List[str]] = None
+
+class UserBulkDelete(BaseModel):
+    role: Optional[str] = None
+    email_prefix: Optional[str] = None
+    emails: Optional[List[str]] = None
+
+# Routes
+@router.post("/students/bulk-delete", dependencies=[Depends(limit_writes)])
+async def bulk_delete_students(criteria: StudentBulkDelete, user_email: str = None):
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    # Check if user is admin
+    user_doc = await db.users.find_one({"email": user_email, "deleted": False})
+    if not user_doc or user_doc["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can delete students")
+    
+    student_filter = {}
+    if criteria.stream is not None:
+        student_filter["stream"] = criteria.stream
+    if criteria.semester is not None:
+        student_filter["current_semester"] = criteria.semester
+    if criteria.roll_numbers is not None:
+        student_filter["roll_number"] = {"$in": criteria.roll_numbers}
+    if not student_filter:
+        raise HTTPException(status_code=400, detail="Specify a stream, semester or roll numbers")
+    
+    job = await create_deletion_job("students", criteria.dict(exclude_none=True), user_email)
+    result = await db.students.update_many({**student_filter, "deleted": False}, deletion_marker(job))
+    await set_deletion_total(job, result.modified_count)
+    if not job.total:
+        raise HTTPException(status_code=404, detail="No matching students")
+    await dashboard.reconcile()
+    
+    # Log activity
+    activity = ActivityLog(
+        action="STUDENTS_BULK_DELETED",
+        user_email=user_email,
+        details={**job.criteria, "count": job.total, "deletion_id": job.id}
+    )
+    await log_activity(activity)
+    
+    return job
+
+@router.post("/users/bulk-delete", dependencies=[Depends(limit_writes)])
+async def bulk_delete_users(criteria: UserBulkDelete, user_email: str = None):
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    # Check if user is admin
+    user_doc = await db.users.find_one({"email": user_email, "deleted": False})
+    if not user_doc or user_doc["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can delete users")
+    
+    user_filter = {}
+    if criteria.role is not None:
+        user_filter["role"] = criteria.role
+    if criteria.emails is not None:
+        user_filter["email"] = {"$in": criteria.emails}
+    if criteria.email_prefix:
+        user_filter.setdefault("email", {})["$regex"] = f"^{re.escape(criteria.email_prefix)}"
+    if not user_filter:
+        raise HTTPException(status_code=400, detail="Specify a role, email prefix or emails")
+    
+    # An admin never deletes their own account
+    user_filter = {"$and": [user_filter, {"email": {"$ne": user_email}}], "deleted": False}
+    job = await create_deletion_job("users", criteria.dict(exclude_none=True), user_email)
+    result = await db.users.update_many(user_filter, deletion_marker(job))
+    await set_deletion_total(job, result.modified_count)
+    if not job.total:
+        raise HTTPException(status_code=404, detail="No matching users")
+    _user_count_cache.clear()
+    await dashboard.reconcile()
+    
+    # Log activity
+    activity = ActivityLog(
+        action="USERS_BULK_DELETED",
+        user_email=user_email,
+        details={**job.criteria, "count": job.total, "deletion_id": job.id}
+    )
+    await log_activity(activity)
+    
+    return job
+
+@router.get("/deletions")
+async def get_deletions(status: Optional[str] = None, user_email: str = None):
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    # Check if user is admin
+    user_doc = await db.users.find_one({"email": user_email, "deleted": False})
+    if not user_doc or user_doc["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can view deletions")
+    
+    job_filter = {"status": status} if status else {}
+    jobs = await db.deletion_jobs.find(job_filter, {"_id": 0}).sort("created_at", -1).to_list(100)
+    return [DeletionJob(**job) for job in jobs]
+
+@router.get("/deletions/{deletion_id}")
+async def get_deletion(deletion_id: str, user_email: str = None):
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    # Check if user is admin
+    user_doc = await db.users.find_one({"email": user_email, "deleted": False})
+    if not user_doc or user_doc["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can view deletions")
+    
+    job = await db.deletion_jobs.find_one({"id": deletion_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Deletion not found")
+    
+    return DeletionJob(**job)
+
+@router.post("/deletions/{deletion_id}/undo", dependencies=[Depends(limit_writes)])
+async def undo_deletion(deletion_id: str, user_email: str = None):
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    # Check if user is admin
+    user_doc = await db.users.find_one({"email": user_email, "deleted": False})
+    if not user_doc or user_doc["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can undo deletions")
+    
+    # Claim the job so the purge task cannot start on it while it is restored
+    now = datetime.utcnow()
+    job = await db.deletion_jobs.find_one_and_update(
+        {"id": deletion_id, "status": "pending", "purge_after": {"$gt": now}},
+        {"$set": {"status": "restoring", "claimed_at": now}},
+        projection={"_id": 0}
+    )
+    if not job:
+        raise HTTPException(status_code=409, detail="Deletion not found or no longer undoable")
+    
+    # Anything re-created with the same roll number or email since stays deleted
+    collection = db[job["collection"]]
+    unique_field = RESTORE_UNIQUE_FIELDS[job["collection"]]
+    deleted_values = await collection.distinct(unique_field, {"deletion_id": deletion_id, "deleted": True})
+    taken = await collection.distinct(unique_field, {unique_field: {"$in": deleted_values}, "deleted": False})
+    
+    result = await collection.update_many(
+        {"deletion_id": deletion_id, "deleted": True, unique_field: {"$nin": taken}},
+        {"$set": {"deleted": False}, "$unset": {"deleted_at": "", "deletion_id": ""}}
+    )
+    remaining = await collection.count_documents({"deletion_id": deletion_id, "deleted": True})
+    await db.deletion_jobs.update_one(
+        {"id": deletion_id},
+        {
+            # Conflicting documents are still purged when the window closes
+            "$set": {"status": "pending" if remaining else "restored", "conflicts": remaining},
+            "$inc": {"restored": result.modified_count}
+        }
+    )
+    if job["collection"] == "users":
+        _user_count_cache.clear()
+    await dashboard.reconcile()
+    
+    # Log activity
+    activity = ActivityLog(
+        action="DELETION_UNDONE",
+        user_email=user_email,
+        details={"deletion_id": deletion_id, "restored": result.modified_count, "conflicts": remaining}
+    )
+    await log_activity(activity)
+    
+    return DeletionJob(**await db.deletion_jobs.find_one({"id": deletion_id}, {"_id": 0}))
@@ -0,0 +1,167 @@
+# Grading scheme management and bulk regrade routes.
+# Grade lookup itself lives in server.py because every marks update needs it;
+# this module only holds the admin routes and is loaded on first use.
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel, Field
+from pymongo.errors import DuplicateKeyError
+from typing import List, Optional
+from datetime import datetime
+import uuid
+
+from server import (
+    ActivityLog,
+    attach_semester_results,
+    CompiledGradingScheme,
+    db,
+    get_grading_scheme,
+    invalidate_analytics,
+    invalidate_grading_cache,
+    limit_writes,
+    log_activity,
+    record_semester_versions,
+    write_semester_updates,
+)
+
+router = APIRouter(prefix="/api")
+
+SCHEME_VERSION_ATTEMPTS = 5
+
+# Grading Scheme Models
+class GradeBoundary(BaseModel):
+    min_marks: int
+    grade: str
+    passing: Optional[bool] = None  # Defaults to failing for the lowest boundary only
+
+class GradingSchemeCreate(BaseModel):
+    name: str
+    stream: Optional[str] = None  # None applies to every stream without its own scheme
+    boundaries: List[GradeBoundary]
+
+class GradingScheme(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    name: str
+    stream: Optional[str] = None
+    version: int
+    boundaries: List[GradeBoundary]
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_by: Optional[str] = None
+
+class RegradeRequest(BaseModel):
+    stream: str
+    semester: str
+
+# Routes
+@router.get("/grading-schemes")
+async def get_grading_schemes(stream: Optional[str] = None, user_email: str = None):
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    scheme_filter = {"stream": stream} if stream is not None else {}
+    schemes = await db.grading_schemes.find(scheme_filter).sort([("stream", 1), ("version", -1)]).to_list(1000)
+    return [GradingScheme(**scheme) for scheme in schemes]
+
+@router.post("/grading-schemes", dependencies=[Depends(limit_writes)])
+async def create_grading_scheme(scheme_data: GradingSchemeCreate, user_email: str = None):
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    # Check if user is admin
+    user_doc = await db.users.find_one({"email": user_email, "deleted": False})
+    if not user_doc or user_doc["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can manage grading schemes")
+    
+    thresholds = [boundary.min_marks for boundary in scheme_data.boundaries]
+    if len(set(thresholds)) != len(thresholds):
+        raise HTTPException(status_code=400, detail="Grade boundaries must have distinct minimum marks")
+    if not thresholds or min(thresholds) > 0:
+        raise HTTPException(status_code=400, detail="Grading scheme must have a boundary at 0 marks")
+    passing = CompiledGradingScheme([(b.min_marks, b.grade, b.passing) for b in scheme_data.boundaries]).passing
+    if passing != sorted(passing):
+        raise HTTPException(status_code=400, detail="Passing grades must all be above the failing grades")
+    
+    # Schemes are never edited in place; each change is a new version. A
+    # concurrent create can take the same version number, in which case the
+    # unique (stream, version) index rejects ours and we try the next one.
+    for _ in range(SCHEME_VERSION_ATTEMPTS):
+        latest = await db.grading_schemes.find_one({"stream": scheme_data.stream}, sort=[("version", -1)])
+        scheme = GradingScheme(
+            name=scheme_data.name,
+            stream=scheme_data.stream,
+            version=(latest["version"] + 1) if latest else 1,
+            boundaries=sorted(scheme_data.boundaries, key=lambda boundary: boundary.min_marks),
+            created_by=user_email
+        )
+        try:
+            await db.grading_schemes.insert_one(scheme.dict())
+            break
+        except DuplicateKeyError:
+            continue
+    else:
+        raise HTTPException(status_code=409, detail="Grading scheme was changed concurrently, please retry")
+    invalidate_grading_cache()
+    
+    # Log activity
+    activity = ActivityLog(
+        action="GRADING_SCHEME_CREATED",
+        user_email=user_email,
+        details={"name": scheme.name, "stream": scheme.stream, "version": scheme.version}
+    )
+    await log_activity(activity)
+    
+    return scheme
+
+@router.post("/grading-schemes/regrade", dependencies=[Depends(limit_writes)])
+async def regrade_semester(regrade_data: RegradeRequest, user_email: str = None):
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    # Check if user is admin
+    user_doc = await db.users.find_one({"email": user_email, "deleted": False})
+    if not user_doc or user_doc["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can regrade results")
+    
+    invalidate_grading_cache(regrade_data.stream)
+    scheme = await get_grading_scheme(regrade_data.stream)
+    
+    students = await db.students.find({"stream": regrade_data.stream, "deleted": False}, {"_id": 0, "id": 1, "semester_results": 1}).to_list(None)
+    await attach_semester_results(students, regrade_data.semester)
+    results = [
+        (student["id"], sr)
+        for student in students
+        for sr in student.get("semester_results") or []
+        if sr["semester"] == regrade_data.semester
+    ]
+    
+    # Grade every subject of the semester in one vectorised lookup
+    grades, passed = scheme.grade_many([subject["marks"] for _, sr in results for subject in sr["subjects"]])
+    updates = []
+    position = 0
+    for student_id, sr in results:
+        subjects = []
+        for subject in sr["subjects"]:
+            subjects.append({**subject, "grade": grades[position], "passed": passed[position]})
+            position += 1
+        updates.append((student_id, {"subjects": subjects, "grading_scheme": scheme.scheme_id}))
+    await write_semester_updates(regrade_data.semester, updates)
+    await record_semester_versions(
+        regrade_data.semester,
+        [(student_id, {**sr, **fields}) for (student_id, sr), (_, fields) in zip(results, updates)],
+        "SEMESTER_REGRADED",
+        user_email
+    )
+    await invalidate_analytics(regrade_data.stream, regrade_data.semester)
+    
+    # Log activity
+    activity = ActivityLog(
+        action="SEMESTER_REGRADED",
+        user_email=user_email,
+        details={
+            "stream": regrade_data.stream,
+            "semester": regrade_data.semester,
+            "grading_scheme": scheme.scheme_id,
+            "results_regraded": len(results)
+        }
+    )
+    await log_activity(activity)
+
+    return {"message": "Semester regraded successfully", "results_regraded": len(results)}
@@ -0,0 +1,136 @@
+# Student change history and point-in-time reads.
+# Loaded on first use by server.py; see FEATURE_ROUTERS there.
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel
+from typing import Any, Dict, List, Optional
+from datetime import datetime
+
+from server import db, HISTORY_UNTRACKED_FIELDS, Student
+
+router = APIRouter(prefix="/api")
+
+class StudentVersionSummary(BaseModel):
+    version: int
+    action: str
+    user_email: str
+    timestamp: datetime
+    changed_fields: List[str]
+
+class StudentVersion(BaseModel):
+    version: int
+    action: str
+    user_email: str
+    timestamp: datetime
+    changes: Dict[str, Any]
+    student: Student
+
+# Reconstruction
+def tracked_changes(changes: dict) -> dict:
+    # Versions recorded before a field became untracked may still carry it
+    return {key: value for key, value in changes.items() if key not in HISTORY_UNTRACKED_FIELDS}
+
+def apply_changes(state: dict, changes: dict):
+    for key, value in changes.items():
+        if key == "semester_results":
+            state["semester_results"].update(value)
+        else:
+            state[key] = value
+
+async def reconstruct_student(student_id: str, version: int) -> Optional[StudentVersion]:
+    # Start from the nearest snapshot at or before `version` and replay the diffs after it
+    base = await db.student_versions.find_one(
+        {"student_id": student_id, "version": {"$lte": version}, "snapshot": {"$exists": True}},
+        sort=[("version", -1)]
+    )
+    if not base:
+        return None
+    
+    state = dict(base["snapshot"])
+    state["semester_results"] = dict(state.get("semester_results") or {})
+    target = base
+    diffs = db.student_versions.find(
+        {"student_id": student_id, "version": {"$gt": base["version"], "$lte": version}},
+        {"_id": 0, "snapshot": 0}
+    ).sort("version", 1)
+    async for entry in diffs:
+        apply_changes(state, entry["changes"])
+        target = entry
+    if target["version"] != version:
+        return None
+    
+    state["semester_results"] = list(state["semester_results"].values())
+    state["updated_at"] = target["timestamp"]
+    state["updated_by"] = target["user_email"]
+    return StudentVersion(
+        version=target["version"],
+        action=target["action"],
+        user_email=target["user_email"],
+        timestamp=target["timestamp"],
+        changes=tracked_changes(target["changes"]),
+        student=Student(**state)
+    )
+
+async def ensure_live_student(student_id: str):
+    # History of a soft-deleted student is hidden along with the student
+    if not await db.students.find_one({"id": student_id, "deleted": False}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Student not found")
+
+# Routes
+@router.get("/students/{student_id}/versions")
+async def get_student_versions(student_id: str, limit: int = 50, before: Optional[int] = None, user_email: str = None):
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    await ensure_live_student(student_id)
+    version_filter = {"student_id": student_id}
+    if before is not None:
+        version_filter["version"] = {"$lt": before}
+    entries = await db.student_versions.find(version_filter, {"_id": 0, "snapshot": 0}) \
+        .sort("version", -1).limit(min(max(limit, 1), 200)).to_list(None)
+    return [
+        StudentVersionSummary(
+            version=entry["version"],
+            action=entry["action"],
+            user_email=entry["user_email"],
+            timestamp=entry["timestamp"],
+            changed_fields=sorted(tracked_changes(entry["changes"]))
+        )
+        for entry in entries
+    ]
+
+@router.get("/students/{student_id}/versions/{version}")
+async def get_student_version(student_id: str, version: int, user_email: str = None):
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    await ensure_live_student(student_id)
+    student_version = await reconstruct_student(student_id, version)
+    if not student_version:
+        raise HTTPException(status_code=404, detail="Student version not found")
+    
+    return student_version
+
+@router.get("/students/{student_id}/as-of")
+async def get_student_as_of(student_id: str, timestamp: datetime, user_email: str = None):
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    await ensure_live_student(student_id)
+    
+    # Naive UTC like every stored timestamp
+    if timestamp.tzinfo is not None:
+        timestamp = (timestamp - timestamp.utcoffset()).replace(tzinfo=None)
+    
+    entry = await db.student_versions.find_one(
+        {"student_id": student_id, "timestamp": {"$lte": timestamp}},
+        {"version": 1},
+        sort=[("timestamp", -1), ("version", -1)]
+    )
+    if not entry:
+        raise HTTPException(status_code=404, detail="Student did not exist at that time")
+    
+    student_version = await reconstruct_student(student_id, entry["version"])
+    if not student_version:
+        raise HTTPException(status_code=404, detail="Student version not found")
+    
+    return student_version
@@ -0,0 +1,162 @@
+# Student photo upload and serving routes, loaded on first use by server.py.
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from gridfs.errors import NoFile
+from starlette.datastructures import UploadFile
+from starlette.formparsers import MultiPartException, MultiPartParser
+from typing import Optional
+from datetime import datetime
+import io
+import os
+import uuid
+
+from server import ActivityLog, db, delete_photo, limit_writes, log_activity, photo_bucket, run_in_process_pool
+
+router = APIRouter(prefix="/api")
+
+# Photo uploads
+# Uploads are parsed straight off the request stream with a hard byte limit,
+# sniffed for a real image signature, then resized and re-encoded in the
+# process pool before being stored in the `photos` GridFS bucket.
+PHOTO_MAX_BYTES = int(os.environ.get("PHOTO_MAX_BYTES", str(5 * 1024 * 1024)))
+PHOTO_MAX_PIXELS = int(os.environ.get("PHOTO_MAX_PIXELS", str(40 * 1000 * 1000)))
+PHOTO_MAX_DIMENSION = int(os.environ.get("PHOTO_MAX_DIMENSION", "512"))
+PHOTO_FORMAT = os.environ.get("PHOTO_FORMAT", "WEBP")
+PHOTO_CACHE_SECONDS = int(os.environ.get("PHOTO_CACHE_SECONDS", "300"))
+PHOTO_CONTENT_TYPES = {"WEBP": "image/webp", "JPEG": "image/jpeg"}
+PHOTO_MULTIPART_OVERHEAD = 16 * 1024
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+def process_photo(data: bytes, max_dimension: int, output_format: str) -> bytes:
+    # Pillow is only needed in the worker processes
+    from PIL import Image, ImageOps
+    
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            width, height = image.size
+            if width * height > PHOTO_MAX_PIXELS:
+                raise ValueError("Image dimensions are too large")
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_dimension, max_dimension))
+            if output_format == "JPEG" and image.mode != "RGB":
+                image = image.convert("RGB")
+            elif image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA")
+            out = io.BytesIO()
+            image.save(out, format=output_format, quality=85)
+            return out.getvalue()
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"Could not decode image: {e}")
+
+async def read_photo_upload(request: Request) -> bytes:
+    content_length = request.headers.get("content-length")
+    if content_length and int(content_length) > PHOTO_MAX_BYTES + PHOTO_MULTIPART_OVERHEAD:
+        raise HTTPException(status_code=413, detail="Photo is too large")
+    if not request.headers.get("content-type", "").startswith("multipart/form-data"):
+        raise HTTPException(status_code=400, detail="Photo must be sent as multipart/form-data")
+    
+    async def limited_stream():
+        received = 0
+        async for chunk in request.stream():
+            received += len(chunk)
+            # Checked per chunk so oversized chunked uploads stop early too
+            if received > PHOTO_MAX_BYTES + PHOTO_MULTIPART_OVERHEAD:
+                raise HTTPException(status_code=413, detail="Photo is too large")
+            yield chunk
+    
+    try:
+        form = await MultiPartParser(request.headers, limited_stream(), max_files=1, max_fields=0).parse()
+    except MultiPartException as e:
+        raise HTTPException(status_code=400, detail=e.message)
+    
+    try:
+        upload = form.get("photo")
+        if not isinstance(upload, UploadFile):
+            raise HTTPException(status_code=400, detail="Missing photo file")
+        if upload.size is not None and upload.size > PHOTO_MAX_BYTES:
+            raise HTTPException(status_code=413, detail="Photo is too large")
+        if sniff_image_type(await upload.read(16)) is None:
+            raise HTTPException(status_code=415, detail="Unsupported image type")
+        await upload.seek(0)
+        return await upload.read()
+    finally:
+        await form.close()
+
+# Routes
+@router.post("/students/{student_id}/photo", dependencies=[Depends(limit_writes)])
+async def upload_student_photo(student_id: str, request: Request, user_email: str = None):
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    existing_student = await db.students.find_one({"id": student_id, "deleted": False}, {"_id": 0, "name": 1, "photo_id": 1})
+    if not existing_student:
+        raise HTTPException(status_code=404, detail="Student not found")
+    
+    data = await read_photo_upload(request)
+    try:
+        content = await run_in_process_pool(process_photo, data, PHOTO_MAX_DIMENSION, PHOTO_FORMAT)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    photo_id = str(uuid.uuid4())
+    await photo_bucket().upload_from_stream(
+        photo_id,
+        content,
+        metadata={"student_id": student_id, "content_type": PHOTO_CONTENT_TYPES[PHOTO_FORMAT]}
+    )
+    photo_url = f"/api/photos/{photo_id}"
+    await db.students.update_one(
+        {"id": student_id},
+        {"$set": {"photo": photo_url, "photo_id": photo_id, "updated_at": datetime.utcnow(), "updated_by": user_email}}
+    )
+    await delete_photo(existing_student.get("photo_id"))
+    
+    # Log activity
+    activity = ActivityLog(
+        action="STUDENT_PHOTO_UPDATED",
+        user_email=user_email,
+        student_id=student_id,
+        student_name=existing_student["name"],
+        details={"original_bytes": len(data), "stored_bytes": len(content)}
+    )
+    await log_activity(activity)
+    
+    return {"message": "Photo uploaded successfully", "photo": photo_url}
+
+@router.get("/photos/{photo_id}")
+async def get_photo(photo_id: str):
+    try:
+        grid_out = await photo_bucket().open_download_stream_by_name(photo_id)
+    except NoFile:
+        raise HTTPException(status_code=404, detail="Photo not found")
+    
+    # Photos of soft-deleted students stay in GridFS until the purge but are not served
+    metadata = grid_out.metadata or {}
+    if not await db.students.find_one({"id": metadata.get("student_id"), "deleted": False}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Photo not found")
+    
+    async def chunks():
+        while True:
+            chunk = await grid_out.readchunk()
+            if not chunk:
+                break
+            yield chunk
+    
+    return StreamingResponse(
+        chunks(),
+        media_type=metadata.get("content_type", "application/octet-stream"),
+        # Private and short-lived, so a deleted student's photo stops being served soon after
+        headers={"Cache-Control": f"private, max-age={PHOTO_CACHE_SECONDS}"}
+    )
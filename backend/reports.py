@@ -0,0 +1,225 @@
+# Report card rendering and export routes.
+# Loaded on first use by server.py; see FEATURE_ROUTERS there.
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import HTMLResponse, Response
+from typing import List, Optional
+from collections import OrderedDict
+import asyncio
+import hashlib
+import html
+import io
+import json
+import os
+import re
+import zipfile
+
+from server import attach_semester_results, db, find_students_with_semester, run_in_process_pool
+
+router = APIRouter(prefix="/api")
+
+# Report card rendering
+# These run inside the process pool, so they only take plain dicts and
+# must not touch the database.
+REPORT_FORMATS = {"html": "text/html", "pdf": "application/pdf"}
+REPORT_CACHE_SIZE = int(os.environ.get("REPORT_CACHE_SIZE", "512"))
+
+def _report_semesters(student: dict, semester: Optional[str]) -> List[dict]:
+    results = student.get("semester_results") or []
+    if semester is not None:
+        results = [sr for sr in results if sr["semester"] == semester]
+    return sorted(results, key=lambda sr: sr["semester"])
+
+def _report_lines(student: dict, semester: Optional[str]) -> List[str]:
+    lines = [
+        "SEMESTER REPORT CARD",
+        "",
+        f"Name:     {student['name']}",
+        f"Roll No:  {student['roll_number']}",
+        f"Stream:   {student['stream']}",
+        f"Semester: {semester or student.get('current_semester', '')}",
+    ]
+    semesters = _report_semesters(student, semester)
+    if not semesters:
+        lines += ["", "No results recorded."]
+    for sr in semesters:
+        subjects = sr.get("subjects") or []
+        total = sum(subject["marks"] for subject in subjects)
+        lines += ["", f"Semester {sr['semester']}", "-" * 60]
+        lines.append(f"{'Subject':<40}{'Marks':>10}{'Grade':>10}")
+        for subject in subjects:
+            lines.append(f"{subject['name'][:40]:<40}{subject['marks']:>10}{subject['grade']:>10}")
+        lines.append("-" * 60)
+        if subjects:
+            lines.append(f"{'Total':<40}{total:>10}{total / len(subjects):>9.1f}%")
+    return lines
+
+def render_report_html(student: dict, semester: Optional[str] = None) -> bytes:
+    esc = html.escape
+    parts = [
+        "<!DOCTYPE html><html><head><meta charset=\"utf-8\">",
+        f"<title>Report Card - {esc(student['name'])}</title>",
+        "<style>body{font-family:sans-serif;margin:2em}table{border-collapse:collapse;width:100%;margin-bottom:1.5em}"
+        "th,td{border:1px solid #ccc;padding:4px 8px;text-align:left}th{background:#f3f4f6}</style>",
+        "</head><body>",
+        "<h1>Semester Report Card</h1>",
+        f"<p><strong>Name:</strong> {esc(student['name'])}<br>",
+        f"<strong>Roll No:</strong> {esc(student['roll_number'])}<br>",
+        f"<strong>Stream:</strong> {esc(student['stream'])}</p>",
+    ]
+    semesters = _report_semesters(student, semester)
+    if not semesters:
+        parts.append("<p>No results recorded.</p>")
+    for sr in semesters:
+        subjects = sr.get("subjects") or []
+        parts.append(f"<h2>Semester {esc(sr['semester'])}</h2>")
+        parts.append("<table><tr><th>Subject</th><th>Marks</th><th>Grade</th></tr>")
+        for subject in subjects:
+            parts.append(
+                f"<tr><td>{esc(subject['name'])}</td><td>{subject['marks']}</td><td>{esc(subject['grade'])}</td></tr>"
+            )
+        if subjects:
+            total = sum(subject["marks"] for subject in subjects)
+            parts.append(f"<tr><th>Total</th><th>{total}</th><th>{total / len(subjects):.1f}%</th></tr>")
+        parts.append("</table>")
+    parts.append("</body></html>")
+    return "".join(parts).encode("utf-8")
+
+def _pdf_text(value: str) -> str:
+    value = value.encode("latin-1", "replace").decode("latin-1")
+    return value.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def render_report_pdf(student: dict, semester: Optional[str] = None, lines_per_page: int = 60) -> bytes:
+    # Minimal single-font PDF writer; report cards are plain monospaced text,
+    # so there is no need for a full layout library.
+    lines = _report_lines(student, semester)
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Courier >>"]
+    page_refs = []
+    for page in pages:
+        text = " T* ".join(f"({_pdf_text(line)}) Tj" for line in page)
+        stream = f"BT /F1 10 Tf 12 TL 50 800 Td {text} ET"
+        objects.append(f"<< /Length {len(stream.encode('latin-1'))} >>\nstream\n{stream}\nendstream")
+        content_ref = len(objects)
+        objects.append(
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_ref} 0 R >>"
+        )
+        page_refs.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(page_refs)}] /Count {len(page_refs)} >>"
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+    xref_offset = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1"))
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode("latin-1"))
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode("latin-1"))
+    return out.getvalue()
+
+def render_report(student: dict, semester: Optional[str], fmt: str) -> bytes:
+    if fmt == "pdf":
+        return render_report_pdf(student, semester)
+    return render_report_html(student, semester)
+
+def report_cache_key(student: dict, semester: Optional[str], fmt: str) -> str:
+    payload = json.dumps(
+        {
+            "id": student["id"],
+            "semester_results": student.get("semester_results") or [],
+            "updated_at": student.get("updated_at"),
+            "semester": semester,
+            "format": fmt,
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+_report_cache: "OrderedDict[str, bytes]" = OrderedDict()
+
+async def get_report(student_doc: dict, semester: Optional[str], fmt: str) -> bytes:
+    student = {
+        key: student_doc.get(key)
+        for key in ("id", "name", "roll_number", "stream", "current_semester", "semester_results", "updated_at")
+    }
+    key = report_cache_key(student, semester, fmt)
+    cached = _report_cache.get(key)
+    if cached is not None:
+        _report_cache.move_to_end(key)
+        return cached
+
+    content = await run_in_process_pool(render_report, student, semester, fmt)
+
+    _report_cache[key] = content
+    if len(_report_cache) > REPORT_CACHE_SIZE:
+        _report_cache.popitem(last=False)
+    return content
+
+def build_archive(entries: List[tuple]) -> bytes:
+    # Runs in the process pool; `entries` holds (filename, content) pairs
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zf:
+        for filename, content in entries:
+            zf.writestr(filename, content)
+    return archive.getvalue()
+
+def report_filename(student: dict, semester: Optional[str], fmt: str) -> str:
+    name = student["roll_number"] + (f"_sem{semester}" if semester else "")
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", name) + f".{fmt}"
+
+# Routes
+@router.get("/students/{student_id}/report")
+async def get_student_report(student_id: str, format: str = "html", semester: Optional[str] = None, user_email: str = None):
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    if format not in REPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid report format")
+    
+    student = await db.students.find_one({"id": student_id, "deleted": False}, {"photo": 0})
+    if not student:
+        raise HTTPException(status_code=404, detail="Student not found")
+    
+    await attach_semester_results([student])
+    content = await get_report(student, semester, format)
+    if format == "html":
+        return HTMLResponse(content)
+    
+    filename = report_filename(student, semester, format)
+    return Response(
+        content,
+        media_type=REPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@router.get("/reports/batch")
+async def get_batch_reports(stream: str, semester: str, format: str = "pdf", user_email: str = None):
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    if format not in REPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid report format")
+    
+    students = await find_students_with_semester({"stream": stream, "deleted": False}, semester, {"photo": 0})
+    if not students:
+        raise HTTPException(status_code=404, detail="No results found for this stream and semester")
+    
+    # Cached cards return immediately; the rest render concurrently in the pool
+    contents = await asyncio.gather(*(get_report(student, semester, format) for student in students))
+    
+    # Compressing a whole stream's reports is CPU-bound too
+    archive = await run_in_process_pool(build_archive, [
+        (report_filename(student, semester, format), content) for student, content in zip(students, contents)
+    ])
+    
+    filename = re.sub(r"[^A-Za-z0-9_.-]+", "_", f"{stream}_sem{semester}_reports") + ".zip"
+    return Response(
+        archive,
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
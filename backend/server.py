@@ -1,7 +1,11 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
 import os
 import logging
 from pathlib import Path
@@ -12,6 +16,16 @@ from datetime import datetime, timedelta
 import hashlib
 import base64
 import json
+import asyncio
+import functools
+import importlib
+import math
+import multiprocessing
+import re
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -50,10 +64,12 @@ class Subject(BaseModel):
     name: str
     marks: int
     grade: str
+    passed: Optional[bool] = None  # Set from the grading scheme along with the grade
 
 class SemesterResult(BaseModel):
     semester: str
     subjects: List[Subject]
+    grading_scheme: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class StudentCreate(BaseModel):
@@ -76,6 +92,7 @@ class Student(BaseModel):
     roll_number: str
     stream: str
     photo: Optional[str] = None
+    photo_id: Optional[str] = None
     current_semester: str
     semester_results: List[SemesterResult] = []
     created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -96,6 +113,22 @@ class ActivityLog(BaseModel):
     details: Dict[str, Any] = {}
     timestamp: datetime = Field(default_factory=datetime.utcnow)
 
+# Deletion Job Model
+class DeletionJob(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    collection: str  # "students" or "users"
+    criteria: Dict[str, Any] = {}
+    requested_by: str
+    status: str = "pending"  # pending, restoring, restored, purging, purged
+    total: int = 0
+    purged: int = 0
+    restored: int = 0
+    conflicts: int = 0
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    purge_after: datetime
+    claimed_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
 # Helper functions
 def hash_password(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
@@ -103,28 +136,828 @@ def hash_password(password: str) -> str:
 def verify_password(password: str, hashed_password: str) -> bool:
     return hash_password(password) == hashed_password
 
-def calculate_grade(marks: int) -> str:
-    if marks >= 90:
-        return "A+"
-    elif marks >= 80:
-        return "A"
-    elif marks >= 70:
-        return "B+"
-    elif marks >= 60:
-        return "B"
-    elif marks >= 50:
-        return "C"
-    elif marks >= 40:
-        return "D"
+# Photo storage
+# Processed student photos live in the `photos` GridFS bucket, one file per upload
+# named by a random photo id.
+def photo_bucket() -> AsyncIOMotorGridFSBucket:
+    return AsyncIOMotorGridFSBucket(db, bucket_name="photos")
+
+async def delete_photo(photo_id: Optional[str]):
+    if not photo_id:
+        return
+    bucket = photo_bucket()
+    async for grid_out in bucket.find({"filename": photo_id}):
+        await bucket.delete(grid_out._id)
+
+# Grading schemes
+# Boundaries are compiled once into ascending threshold arrays; a mark's grade
+# is the last threshold it reaches. Each boundary is (min_marks, grade) or
+# (min_marks, grade, passing); without a passing flag only the lowest fails.
+DEFAULT_GRADE_BOUNDARIES = [
+    (0, "F"), (40, "D"), (50, "C"), (60, "B"), (70, "B+"), (80, "A"), (90, "A+"),
+]
+GRADING_CACHE_TTL = int(os.environ.get("GRADING_CACHE_TTL", "60"))
+
+class CompiledGradingScheme:
+    def __init__(self, boundaries: List[tuple], scheme_id: Optional[str] = None):
+        ordered = sorted(boundaries, key=lambda boundary: boundary[0])
+        self.scheme_id = scheme_id
+        self.thresholds = [boundary[0] for boundary in ordered]
+        self.grades = [boundary[1] for boundary in ordered]
+        self.passing = [
+            boundary[2] if len(boundary) > 2 and boundary[2] is not None else index > 0
+            for index, boundary in enumerate(ordered)
+        ]
+        self._np_tables = None
+
+    def _index(self, marks: int) -> int:
+        return max(bisect_right(self.thresholds, marks) - 1, 0)
+
+    def grade(self, marks: int) -> str:
+        return self.grades[self._index(marks)]
+
+    def passes(self, marks: int) -> bool:
+        return self.passing[self._index(marks)]
+
+    def grade_many(self, marks: List[int]) -> tuple:
+        # Returns (grades, passed) lists. NumPy is only needed for batch
+        # regrades, so keep it off the import path
+        import numpy as np
+        
+        if self._np_tables is None:
+            self._np_tables = (
+                np.array(self.thresholds),
+                np.array(self.grades, dtype=object),
+                np.array(self.passing, dtype=bool)
+            )
+        thresholds, grades, passing = self._np_tables
+        indexes = np.maximum(np.searchsorted(thresholds, np.asarray(marks), side="right") - 1, 0)
+        return grades[indexes].tolist(), passing[indexes].tolist()
+
+DEFAULT_GRADING_SCHEME = CompiledGradingScheme(DEFAULT_GRADE_BOUNDARIES)
+
+_grading_cache: Dict[Optional[str], tuple] = {}
+
+def compile_grading_scheme(scheme_doc: dict) -> CompiledGradingScheme:
+    boundaries = [(b["min_marks"], b["grade"], b.get("passing")) for b in scheme_doc["boundaries"]]
+    return CompiledGradingScheme(boundaries, f"{scheme_doc['name']} v{scheme_doc['version']}")
+
+def invalidate_grading_cache(stream: Optional[str] = None):
+    if stream is None:
+        _grading_cache.clear()
+    else:
+        _grading_cache.pop(stream, None)
+
+async def get_grading_scheme(stream: Optional[str]) -> CompiledGradingScheme:
+    cached = _grading_cache.get(stream)
+    if cached and time.monotonic() - cached[1] < GRADING_CACHE_TTL:
+        return cached[0]
+    
+    # Latest version for the stream, falling back to the latest default scheme
+    scheme_doc = None
+    for candidate in ([stream, None] if stream is not None else [None]):
+        scheme_doc = await db.grading_schemes.find_one({"stream": candidate}, sort=[("version", -1)])
+        if scheme_doc:
+            break
+    scheme = compile_grading_scheme(scheme_doc) if scheme_doc else DEFAULT_GRADING_SCHEME
+    _grading_cache[stream] = (scheme, time.monotonic())
+    return scheme
+
+# Process pool
+# CPU-bound work (report rendering and archiving, photo re-encoding) runs here
+# so it never blocks the event loop. Workers are started from a forkserver
+# rather than forked from this process, whose Motor monitor threads would be
+# copied mid-flight.
+WORKER_PROCESSES = int(os.environ.get("WORKER_PROCESSES", "2"))
+WORKER_START_METHOD = os.environ.get("WORKER_START_METHOD", "forkserver")
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(
+            max_workers=WORKER_PROCESSES,
+            mp_context=multiprocessing.get_context(WORKER_START_METHOD)
+        )
+    return _process_pool
+
+async def run_in_process_pool(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_process_pool(), func, *args)
+
+# User directory helpers
+USER_PROJECTION = {"_id": 0, "id": 1, "email": 1, "name": 1, "role": 1, "created_at": 1}
+USER_COUNT_TTL = int(os.environ.get("USER_COUNT_TTL", "30"))
+# Each distinct (role, email prefix) search adds an entry, so keep only the most recent
+USER_COUNT_CACHE_SIZE = int(os.environ.get("USER_COUNT_CACHE_SIZE", "256"))
+
+_user_count_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+def user_directory_filter(role: Optional[str], email_prefix: Optional[str]) -> dict:
+    user_filter = {"deleted": False}
+    if role:
+        user_filter["role"] = role
+    if email_prefix:
+        # Anchored, case-sensitive prefix regexes can use the email index
+        user_filter["email"] = {"$regex": f"^{re.escape(email_prefix)}"}
+    return user_filter
+
+def encode_cursor(value: str) -> str:
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+def decode_cursor(cursor: str) -> str:
+    try:
+        return base64.urlsafe_b64decode(cursor.encode()).decode()
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def count_users(role: Optional[str], email_prefix: Optional[str]) -> int:
+    key = (role, email_prefix)
+    cached = _user_count_cache.get(key)
+    if cached and time.monotonic() - cached[1] < USER_COUNT_TTL:
+        _user_count_cache.move_to_end(key)
+        return cached[0]
+    
+    # Soft-deleted users are still in the collection, so this is always a
+    # filtered count; the live-only partial indexes keep it an index scan
+    count = await db.users.count_documents(user_directory_filter(role, email_prefix))
+    _user_count_cache[key] = (count, time.monotonic())
+    _user_count_cache.move_to_end(key)
+    if len(_user_count_cache) > USER_COUNT_CACHE_SIZE:
+        _user_count_cache.popitem(last=False)
+    return count
+
+# NDJSON streaming
+# List endpoints stream one document per line straight off the Motor cursor when
+# the client sends Accept: application/x-ndjson, so memory and time to first
+# byte do not grow with the result size.
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+NDJSON_BATCH_SIZE = 100
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+def _ndjson_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+def ndjson_response(cursor, transform=None) -> StreamingResponse:
+    async def lines():
+        batch = []
+        async for doc in cursor.batch_size(NDJSON_BATCH_SIZE):
+            batch.append(doc)
+            if len(batch) >= NDJSON_BATCH_SIZE:
+                if transform:
+                    await transform(batch)
+                yield "".join(json.dumps(doc, default=_ndjson_default) + "\n" for doc in batch)
+                batch = []
+        if batch:
+            if transform:
+                await transform(batch)
+            yield "".join(json.dumps(doc, default=_ndjson_default) + "\n" for doc in batch)
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE)
+
+# Rate limiting
+# Token buckets refill continuously at `rate` tokens per second up to `capacity`.
+# The in-memory backend is per process; set RATE_LIMIT_BACKEND=mongo to share
+# buckets between replicas.
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")
+AUTH_RATE_CAPACITY = int(os.environ.get("AUTH_RATE_CAPACITY", "10"))
+AUTH_RATE_PER_SECOND = float(os.environ.get("AUTH_RATE_PER_SECOND", "0.2"))
+WRITE_RATE_CAPACITY = int(os.environ.get("WRITE_RATE_CAPACITY", "60"))
+WRITE_RATE_PER_SECOND = float(os.environ.get("WRITE_RATE_PER_SECOND", "1"))
+MAX_IN_FLIGHT_REQUESTS = int(os.environ.get("MAX_IN_FLIGHT_REQUESTS", "256"))
+# Number of reverse proxies in front of the app that append to X-Forwarded-For.
+# Deployments behind an ingress must set this (backend/.env sets 1 for the
+# cluster ingress); with 0 the header is ignored and the socket peer is the
+# client, so every client behind a proxy would share one rate limit bucket.
+# Running uvicorn with --proxy-headers --forwarded-allow-ips=<ingress> instead
+# fixes up the socket peer itself and works with 0.
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", "0"))
+
+class InMemoryRateLimitBackend:
+    def __init__(self, max_keys: int = 10000):
+        self.max_keys = max_keys
+        self.buckets: "OrderedDict[str, tuple]" = OrderedDict()
+
+    async def take(self, key: str, capacity: int, rate: float) -> float:
+        now = time.monotonic()
+        tokens, updated = self.buckets.pop(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * rate)
+        if tokens >= 1:
+            tokens -= 1
+            retry_after = 0.0
+        else:
+            retry_after = (1 - tokens) / rate
+        self.buckets[key] = (tokens, now)
+        if len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        return retry_after
+
+class MongoRateLimitBackend:
+    async def take(self, key: str, capacity: int, rate: float) -> float:
+        now = datetime.utcnow()
+        elapsed = {"$divide": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, 1000]}
+        refilled = {"$min": [capacity, {"$add": [{"$ifNull": ["$tokens", capacity]}, {"$multiply": [elapsed, rate]}]}]}
+        # Refill and take in a single atomic pipeline update so concurrent
+        # replicas never double-spend a token
+        bucket = await db.rate_limits.find_one_and_update(
+            {"key": key},
+            [
+                {"$set": {"tokens": refilled, "updated_at": now, "expires_at": now + timedelta(seconds=capacity / rate)}},
+                {"$set": {
+                    "allowed": {"$gte": ["$tokens", 1]},
+                    "tokens": {"$cond": [{"$gte": ["$tokens", 1]}, {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                }},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if bucket["allowed"]:
+            return 0.0
+        return (1 - bucket["tokens"]) / rate
+
+class TokenBucketLimiter:
+    def __init__(self, name: str, capacity: int, rate: float):
+        self.name = name
+        self.capacity = capacity
+        self.rate = rate
+
+    async def hit(self, key: str) -> None:
+        retry_after = await get_rate_limit_backend().take(f"{self.name}:{key}", self.capacity, self.rate)
+        if retry_after > 0:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests",
+                headers={"Retry-After": str(math.ceil(retry_after))}
+            )
+
+_rate_limit_backend = None
+
+def get_rate_limit_backend():
+    global _rate_limit_backend
+    if _rate_limit_backend is None:
+        if RATE_LIMIT_BACKEND == "mongo":
+            _rate_limit_backend = MongoRateLimitBackend()
+        else:
+            _rate_limit_backend = InMemoryRateLimitBackend()
+    return _rate_limit_backend
+
+auth_limiter = TokenBucketLimiter("auth", AUTH_RATE_CAPACITY, AUTH_RATE_PER_SECOND)
+write_limiter = TokenBucketLimiter("write", WRITE_RATE_CAPACITY, WRITE_RATE_PER_SECOND)
+
+_proxy_warning_logged = False
+
+def client_address(request: Request) -> str:
+    # Each trusted proxy appends the address it received the request from, so
+    # the client is the right-most entry not added by one of our own proxies.
+    # Anything further left is caller-controlled and ignored.
+    global _proxy_warning_logged
+    forwarded = request.headers.get("x-forwarded-for")
+    if TRUSTED_PROXY_HOPS and forwarded:
+        entries = [entry.strip() for entry in forwarded.split(",") if entry.strip()]
+        if entries:
+            return entries[max(len(entries) - TRUSTED_PROXY_HOPS, 0)]
+    elif forwarded and not _proxy_warning_logged:
+        _proxy_warning_logged = True
+        logger.warning(
+            "Request came through a proxy but TRUSTED_PROXY_HOPS is 0; "
+            "clients behind it share rate limit buckets unless uvicorn runs with --proxy-headers"
+        )
+    return request.client.host if request.client else "unknown"
+
+async def limit_auth(request: Request):
+    await auth_limiter.hit(f"client:{client_address(request)}")
+
+async def limit_writes(request: Request):
+    await write_limiter.hit(f"client:{client_address(request)}")
+
+# Semester results storage
+# With RESULTS_STORAGE=collection each semester lives in its own `results`
+# document keyed by (student_id, semester), keeping student documents small.
+# Results still embedded in older student documents are read as a fallback.
+RESULTS_STORAGE = os.environ.get("RESULTS_STORAGE", "embedded")
+# Only the public Student fields; internal bookkeeping such as `deleted` and
+# `history_version` never leaves the server
+STUDENT_PROFILE_FIELDS = [
+    "id", "name", "roll_number", "stream", "photo", "photo_id",
+    "current_semester", "created_at", "updated_at", "updated_by"
+]
+STUDENT_LIST_PROJECTION = {"_id": 0, **{field: 1 for field in STUDENT_PROFILE_FIELDS}}
+STUDENT_RESULTS_PROJECTION = {**STUDENT_LIST_PROJECTION, "semester_results": 1}
+
+async def attach_semester_results(students: List[dict], semester: Optional[str] = None) -> List[dict]:
+    if RESULTS_STORAGE != "collection" or not students:
+        return students
+    
+    result_filter = {"student_id": {"$in": [student["id"] for student in students]}}
+    if semester is not None:
+        result_filter["semester"] = semester
+    by_student: Dict[str, Dict[str, dict]] = {}
+    async for result in db.results.find(result_filter, {"_id": 0}):
+        by_student.setdefault(result.pop("student_id"), {})[result["semester"]] = result
+    
+    for student in students:
+        merged = {sr["semester"]: sr for sr in student.get("semester_results") or []}
+        merged.update(by_student.get(student["id"], {}))
+        student["semester_results"] = list(merged.values())
+    return students
+
+async def find_students_with_semester(student_filter: dict, semester: str, projection: Optional[dict] = None) -> List[dict]:
+    semester_filter = {"semester_results.semester": semester}
+    if RESULTS_STORAGE == "collection":
+        student_ids = await db.results.distinct("student_id", {"semester": semester})
+        semester_filter = {"$or": [{"id": {"$in": student_ids}}, semester_filter]}
+    
+    students = await db.students.find({**student_filter, **semester_filter}, projection).to_list(None)
+    return await attach_semester_results(students)
+
+async def load_semester_result(student_id: str, semester: str) -> Optional[dict]:
+    # None if the student is deleted, even while its results await the purge
+    student = await db.students.find_one(
+        {"id": student_id, "deleted": False},
+        {"_id": 0, "semester_results": {"$elemMatch": {"semester": semester}}}
+    )
+    if not student:
+        return None
+    
+    if RESULTS_STORAGE == "collection":
+        result = await db.results.find_one({"student_id": student_id, "semester": semester}, {"_id": 0, "student_id": 0})
+        if result:
+            return result
+    return student["semester_results"][0] if student.get("semester_results") else None
+
+async def save_semester_result(student_id: str, semester_result: SemesterResult, user_email: str) -> Optional[dict]:
+    # Returns the student as this write left it, or None if it no longer exists
+    now = datetime.utcnow()
+    if RESULTS_STORAGE == "collection":
+        await db.results.replace_one(
+            {"student_id": student_id, "semester": semester_result.semester},
+            {"student_id": student_id, **semester_result.dict()},
+            upsert=True
+        )
+        student = await db.students.find_one_and_update(
+            {"id": student_id},
+            {
+                "$set": {"updated_at": now, "updated_by": user_email},
+                "$pull": {"semester_results": {"semester": semester_result.semester}},
+                "$inc": {"history_version": 1}
+            },
+            projection=HISTORY_DOCUMENT_PROJECTION,
+            return_document=ReturnDocument.AFTER
+        )
+        return student
+    
+    # Swap the embedded entry for this semester in one atomic pipeline update,
+    # leaving the rest of the student document untouched
+    other_semesters = {
+        "$filter": {
+            "input": {"$ifNull": ["$semester_results", []]},
+            "as": "sr",
+            "cond": {"$ne": ["$$sr.semester", semester_result.semester]}
+        }
+    }
+    student = await db.students.find_one_and_update(
+        {"id": student_id},
+        [{"$set": {
+            "semester_results": {"$concatArrays": [other_semesters, {"$literal": [semester_result.dict()]}]},
+            "updated_at": now,
+            "updated_by": user_email,
+            "history_version": {"$add": [{"$ifNull": ["$history_version", 0]}, 1]}
+        }}],
+        projection=HISTORY_DOCUMENT_PROJECTION,
+        return_document=ReturnDocument.AFTER
+    )
+    return student
+
+async def write_semester_updates(semester: str, updates: List[tuple]):
+    # `updates` holds (student_id, fields) pairs to $set on that student's semester result
+    student_operations = []
+    result_operations = []
+    for student_id, fields in updates:
+        if RESULTS_STORAGE == "collection":
+            result_operations.append(UpdateOne(
+                {"student_id": student_id, "semester": semester},
+                {"$set": fields}
+            ))
+        # Results may still be embedded in older documents; this matches nothing otherwise
+        student_operations.append(UpdateOne(
+            {"id": student_id, "semester_results.semester": semester},
+            {"$set": {f"semester_results.$.{key}": value for key, value in fields.items()}}
+        ))
+    
+    for collection, operations in ((db.students, student_operations), (db.results, result_operations)):
+        for start in range(0, len(operations), 1000):
+            await collection.bulk_write(operations[start:start + 1000], ordered=False)
+
+# Student history
+# Each write to a student bumps `history_version` on the document in the same
+# update and appends a `student_versions` entry holding only the fields it
+# changed. Every HISTORY_SNAPSHOT_INTERVAL versions (starting with the first)
+# also store the full record, so reading any version replays a bounded number
+# of diffs. Semester results are tracked per semester; photos are not tracked,
+# since a replaced photo is deleted and an old version could not show it.
+HISTORY_SNAPSHOT_INTERVAL = int(os.environ.get("HISTORY_SNAPSHOT_INTERVAL", "20"))
+HISTORY_UNTRACKED_FIELDS = {
+    "_id", "photo", "photo_id", "history_version", "updated_at", "updated_by",
+    # Soft-delete bookkeeping is internal, like history_version
+    "deleted", "deleted_at", "deletion_id",
+}
+# What atomic writes return for recording a version: everything but the legacy blob
+HISTORY_DOCUMENT_PROJECTION = {"_id": 0, "photo": 0}
+# Concurrent version writes when a bulk operation touches many students
+HISTORY_BATCH_SIZE = int(os.environ.get("HISTORY_BATCH_SIZE", "100"))
+
+def history_state(student: dict) -> dict:
+    state = {k: v for k, v in student.items() if k not in HISTORY_UNTRACKED_FIELDS}
+    state["semester_results"] = {sr["semester"]: sr for sr in student.get("semester_results") or []}
+    return state
+
+async def record_student_version(
+    student_id: str,
+    version: int,
+    action: str,
+    user_email: str,
+    changes: dict,
+    student: dict,
+    timestamp: Optional[datetime] = None
+):
+    # `student` is the document as this version's write left it, as returned by
+    # the same atomic update, so a snapshot never picks up later versions
+    entry = {
+        "student_id": student_id,
+        "version": version,
+        "action": action,
+        "user_email": user_email,
+        "timestamp": timestamp or datetime.utcnow(),
+        "changes": changes
+    }
+    if (version - 1) % HISTORY_SNAPSHOT_INTERVAL == 0:
+        snapshot_source = dict(student)
+        await attach_semester_results([snapshot_source])
+        entry["snapshot"] = history_state(snapshot_source)
+    await db.student_versions.insert_one(entry)
+
+async def record_semester_versions(semester: str, results: List[tuple], action: str, user_email: str):
+    # For bulk writes such as regrades: `results` holds (student_id, semester
+    # result) pairs already written; each student gets a new version holding it
+    now = datetime.utcnow()
+    
+    async def record(student_id: str, semester_result: dict):
+        student = await db.students.find_one_and_update(
+            {"id": student_id},
+            {"$set": {"updated_at": now, "updated_by": user_email}, "$inc": {"history_version": 1}},
+            projection=HISTORY_DOCUMENT_PROJECTION,
+            return_document=ReturnDocument.AFTER
+        )
+        if student:
+            await record_student_version(
+                student_id, student["history_version"], action, user_email,
+                {"semester_results": {semester: semester_result}}, student, now
+            )
+    
+    for start in range(0, len(results), HISTORY_BATCH_SIZE):
+        await asyncio.gather(*(record(*result) for result in results[start:start + HISTORY_BATCH_SIZE]))
+
+# Analytics cache
+# Cohort statistics per (stream, semester) are cached in `analytics_cache`; see
+# analytics.py. Writes that change a semester's marks or grades bump its
+# generation, which drops the cached stats and stops a computation already in
+# flight from storing what it read.
+ANALYTICS_JOB_TTL = int(os.environ.get("ANALYTICS_JOB_TTL", "86400"))
+
+async def invalidate_analytics(stream: str, semester: str):
+    await db.analytics_cache.update_one(
+        {"stream": stream, "semester": semester},
+        {"$inc": {"generation": 1}, "$unset": {"stats": "", "computed_at": ""}},
+        upsert=True
+    )
+
+# Idempotent writes
+# A write sent with an Idempotency-Key header stores its response under
+# (scope, user, key); retries with the same key replay it instead of writing
+# again. A unique index on `key` makes concurrent duplicates collide. The
+# request holding a pending key owns it for IDEMPOTENCY_LEASE seconds; if it
+# dies without finishing (cancelled, process killed), a retry after the lease
+# takes the key over instead of getting 409 until the TTL expires.
+IDEMPOTENCY_TTL = int(os.environ.get("IDEMPOTENCY_TTL", str(24 * 60 * 60)))
+IDEMPOTENCY_LEASE = int(os.environ.get("IDEMPOTENCY_LEASE", "30"))
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get("IDEMPOTENCY_CACHE_SIZE", "1024"))
+
+_idempotency_cache: "OrderedDict[str, dict]" = OrderedDict()
+
+def _idempotency_response(record: dict) -> JSONResponse:
+    return JSONResponse(
+        status_code=record["status_code"],
+        content=record["response"],
+        headers={"Idempotent-Replayed": "true"}
+    )
+
+def _remember_idempotent(record: dict):
+    _idempotency_cache[record["key"]] = record
+    if len(_idempotency_cache) > IDEMPOTENCY_CACHE_SIZE:
+        _idempotency_cache.popitem(last=False)
+
+async def _claim_idempotency_key(key: str, fingerprint: str, owner: str) -> Optional[dict]:
+    # Returns None once this request owns the key, otherwise the existing record
+    now = datetime.utcnow()
+    try:
+        await db.idempotency_keys.insert_one({
+            "key": key,
+            "fingerprint": fingerprint,
+            "status": "pending",
+            "owner": owner,
+            "created_at": now,
+            "claimed_at": now
+        })
+        return None
+    except DuplicateKeyError:
+        pass
+    
+    expired = now - timedelta(seconds=IDEMPOTENCY_LEASE)
+    taken_over = await db.idempotency_keys.find_one_and_update(
+        {
+            "key": key,
+            "fingerprint": fingerprint,
+            "status": "pending",
+            "$or": [
+                {"claimed_at": {"$lte": expired}},
+                {"claimed_at": {"$exists": False}, "created_at": {"$lte": expired}}
+            ]
+        },
+        {"$set": {"owner": owner, "claimed_at": now}}
+    )
+    if taken_over:
+        return None
+    
+    record = await db.idempotency_keys.find_one({"key": key}, {"_id": 0})
+    if record is None:
+        raise HTTPException(status_code=409, detail="Idempotency-Key is being reset, please retry")
+    return record
+
+def idempotent(scope: str):
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            idempotency_key = kwargs.get("idempotency_key")
+            if not idempotency_key:
+                return await func(*args, **kwargs)
+            
+            key = f"{scope}:{kwargs.get('user_email')}:{idempotency_key}"
+            payload = {name: value for name, value in kwargs.items() if name != "idempotency_key"}
+            fingerprint = hashlib.sha256(
+                json.dumps(jsonable_encoder(payload), sort_keys=True).encode()
+            ).hexdigest()
+            owner = str(uuid.uuid4())
+            
+            record = _idempotency_cache.get(key)
+            if record is None:
+                record = await _claim_idempotency_key(key, fingerprint, owner)
+            
+            if record is not None:
+                if record["fingerprint"] != fingerprint:
+                    raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+                if record["status"] != "done":
+                    raise HTTPException(
+                        status_code=409,
+                        detail="A request with this Idempotency-Key is still in progress",
+                        headers={"Retry-After": "1"}
+                    )
+                _remember_idempotent(record)
+                return _idempotency_response(record)
+            
+            # Release the key if the handler fails or is cancelled, so a retry can
+            # run at once; shielded so a second cancellation cannot skip it
+            async def release():
+                await asyncio.shield(db.idempotency_keys.delete_one({"key": key, "owner": owner}))
+            
+            try:
+                result = await func(*args, **kwargs)
+                status_code, response = 200, jsonable_encoder(result)
+            except HTTPException as e:
+                if e.status_code >= 500:
+                    await release()
+                    raise
+                # Client errors are deterministic for the same request, so replay them too
+                status_code, response = e.status_code, {"detail": e.detail}
+            except BaseException:
+                await release()
+                raise
+            
+            record = {"key": key, "fingerprint": fingerprint, "status": "done", "status_code": status_code, "response": response}
+            await db.idempotency_keys.update_one(
+                {"key": key, "owner": owner},
+                {"$set": {"status": "done", "status_code": status_code, "response": response}}
+            )
+            _remember_idempotent(record)
+            if status_code != 200:
+                raise HTTPException(status_code=status_code, detail=response["detail"])
+            return result
+        return wrapper
+    return decorator
+
+# Dashboard counters
+# Mutating routes adjust the snapshot as they go; a background task
+# periodically replaces it with exact counts from Mongo to correct any drift.
+DASHBOARD_RECONCILE_INTERVAL = int(os.environ.get("DASHBOARD_RECONCILE_INTERVAL", "300"))
+DASHBOARD_ACTIVITY_WINDOW_HOURS = 24
+
+class DashboardSnapshot:
+    def __init__(self):
+        self.loaded = False
+        self.total_students = 0
+        self.total_users = 0
+        self.students_per_stream: Dict[str, int] = {}
+        self.students_per_semester: Dict[str, int] = {}
+        self.recent_activity: Dict[str, int] = {}
+        self.reconciled_at: Optional[datetime] = None
+
+    def _bump(self, counts: Dict[str, int], key: str, delta: int):
+        counts[key] = counts.get(key, 0) + delta
+        if counts[key] <= 0:
+            counts.pop(key)
+
+    def student_added(self, stream: str, semester: str, delta: int = 1):
+        if not self.loaded:
+            return
+        self.total_students += delta
+        self._bump(self.students_per_stream, stream, delta)
+        self._bump(self.students_per_semester, semester, delta)
+
+    def student_removed(self, stream: str, semester: str):
+        self.student_added(stream, semester, -1)
+
+    def user_added(self, delta: int = 1):
+        if self.loaded:
+            self.total_users += delta
+
+    def user_removed(self):
+        self.user_added(-1)
+
+    def activity_logged(self, action: str):
+        # Entries aging out of the window are only dropped on reconcile
+        if self.loaded:
+            self._bump(self.recent_activity, action, 1)
+
+    async def reconcile(self):
+        since = datetime.utcnow() - timedelta(hours=DASHBOARD_ACTIVITY_WINDOW_HOURS)
+        total_students, total_users, streams, semesters, activity = await asyncio.gather(
+            db.students.count_documents({"deleted": False}),
+            db.users.count_documents({"deleted": False}),
+            db.students.aggregate([
+                {"$match": {"deleted": False}},
+                {"$group": {"_id": "$stream", "count": {"$sum": 1}}}
+            ]).to_list(None),
+            db.students.aggregate([
+                {"$match": {"deleted": False}},
+                {"$group": {"_id": "$current_semester", "count": {"$sum": 1}}}
+            ]).to_list(None),
+            db.activity_logs.aggregate([
+                {"$match": {"timestamp": {"$gte": since}}},
+                {"$group": {"_id": "$action", "count": {"$sum": 1}}}
+            ]).to_list(None),
+        )
+        self.total_students = total_students
+        self.total_users = total_users
+        self.students_per_stream = {group["_id"]: group["count"] for group in streams}
+        self.students_per_semester = {group["_id"]: group["count"] for group in semesters}
+        self.recent_activity = {group["_id"]: group["count"] for group in activity}
+        self.reconciled_at = datetime.utcnow()
+        self.loaded = True
+
+    def summary(self, include_admin: bool = False) -> dict:
+        summary = {
+            "total_students": self.total_students,
+            "students_per_stream": self.students_per_stream,
+            "students_per_semester": self.students_per_semester,
+            "reconciled_at": self.reconciled_at,
+        }
+        # User and activity figures are admin-only, like /users and /activity-logs
+        if include_admin:
+            summary["total_users"] = self.total_users
+            summary["recent_activity"] = {
+                "window_hours": DASHBOARD_ACTIVITY_WINDOW_HOURS,
+                "total": sum(self.recent_activity.values()),
+                "by_action": self.recent_activity,
+            }
+        return summary
+
+dashboard = DashboardSnapshot()
+_dashboard_task: Optional[asyncio.Task] = None
+
+async def log_activity(activity: ActivityLog):
+    await db.activity_logs.insert_one(activity.dict())
+    dashboard.activity_logged(activity.action)
+
+async def reconcile_dashboard_periodically():
+    while True:
+        try:
+            await dashboard.reconcile()
+        except Exception:
+            logger.exception("Dashboard reconciliation failed")
+        await asyncio.sleep(DASHBOARD_RECONCILE_INTERVAL)
+
+# Soft deletes
+# Deleting only flags documents (`deleted: True`, `deleted_at`, `deletion_id`)
+# and records a `deletion_jobs` entry; live queries filter on `deleted: False`,
+# which the partial indexes cover. Once DELETION_UNDO_WINDOW has passed, a
+# background task purges the flagged documents (with their results, history
+# and photos) in batches, counting progress on the job.
+DELETION_UNDO_WINDOW = int(os.environ.get("DELETION_UNDO_WINDOW", "86400"))
+PURGE_BATCH_SIZE = int(os.environ.get("PURGE_BATCH_SIZE", "500"))
+PURGE_INTERVAL = int(os.environ.get("PURGE_INTERVAL", "60"))
+# A job left purging or restoring this long is assumed abandoned; once its undo
+# window has closed the purge task reclaims it
+PURGE_LEASE = int(os.environ.get("PURGE_LEASE", "600"))
+
+async def create_deletion_job(collection: str, criteria: dict, user_email: str) -> DeletionJob:
+    now = datetime.utcnow()
+    job = DeletionJob(
+        collection=collection,
+        criteria=criteria,
+        requested_by=user_email,
+        created_at=now,
+        purge_after=now + timedelta(seconds=DELETION_UNDO_WINDOW)
+    )
+    await db.deletion_jobs.insert_one(job.dict())
+    return job
+
+def deletion_marker(job: DeletionJob) -> dict:
+    return {"$set": {"deleted": True, "deleted_at": job.created_at, "deletion_id": job.id}}
+
+async def set_deletion_total(job: DeletionJob, total: int):
+    job.total = total
+    if total:
+        await db.deletion_jobs.update_one({"id": job.id}, {"$set": {"total": total}})
     else:
-        return "F"
+        await db.deletion_jobs.delete_one({"id": job.id})
+
+async def purge_deletion(job: dict):
+    collection = db[job["collection"]]
+    while True:
+        batch = await collection.find(
+            {"deletion_id": job["id"], "deleted": True},
+            {"_id": 0, "id": 1, "photo_id": 1}
+        ).limit(PURGE_BATCH_SIZE).to_list(None)
+        if not batch:
+            break
+        
+        ids = [doc["id"] for doc in batch]
+        if job["collection"] == "students":
+            await db.results.delete_many({"student_id": {"$in": ids}})
+            await db.student_versions.delete_many({"student_id": {"$in": ids}})
+            await asyncio.gather(*(delete_photo(doc.get("photo_id")) for doc in batch))
+        result = await collection.delete_many({"id": {"$in": ids}, "deletion_id": job["id"], "deleted": True})
+        await db.deletion_jobs.update_one(
+            {"id": job["id"]},
+            {"$inc": {"purged": result.deleted_count}, "$set": {"claimed_at": datetime.utcnow()}}
+        )
+    
+    await db.deletion_jobs.update_one(
+        {"id": job["id"]},
+        {"$set": {"status": "purged", "finished_at": datetime.utcnow()}}
+    )
+
+async def purge_due_deletions():
+    while True:
+        now = datetime.utcnow()
+        # Claim atomically so only one replica purges a given job
+        job = await db.deletion_jobs.find_one_and_update(
+            {"$or": [
+                {"status": "pending", "purge_after": {"$lte": now}},
+                {
+                    "status": {"$in": ["purging", "restoring"]},
+                    "purge_after": {"$lte": now},
+                    "claimed_at": {"$lte": now - timedelta(seconds=PURGE_LEASE)}
+                }
+            ]},
+            {"$set": {"status": "purging", "claimed_at": now}},
+            return_document=ReturnDocument.AFTER
+        )
+        if not job:
+            return
+        await purge_deletion(job)
+        if job["collection"] == "users":
+            _user_count_cache.clear()
+
+_purge_task: Optional[asyncio.Task] = None
+
+async def purge_deletions_periodically():
+    while True:
+        try:
+            await purge_due_deletions()
+        except Exception:
+            logger.exception("Deletion purge failed")
+        await asyncio.sleep(PURGE_INTERVAL)
 
 # Authentication dependency
 async def get_current_user(email: str = None):
     if not email:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    user_doc = await db.users.find_one({"email": email})
+    user_doc = await db.users.find_one({"email": email, "deleted": False})
     if not user_doc:
         raise HTTPException(status_code=401, detail="User not found")
     
@@ -135,7 +968,7 @@ async def init_admin():
     admin_email = "rohan@gcet.edu.in"
     admin_password = "Rohan@95@"
     
-    existing_admin = await db.users.find_one({"email": admin_email})
+    existing_admin = await db.users.find_one({"email": admin_email, "deleted": False})
     if not existing_admin:
         admin_user = User(
             email=admin_email,
@@ -144,15 +977,18 @@ async def init_admin():
         )
         admin_dict = admin_user.dict()
         admin_dict["password"] = hash_password(admin_password)
+        admin_dict["deleted"] = False
         
         await db.users.insert_one(admin_dict)
         print(f"Admin user created: {admin_email}")
 
 # Authentication Routes
-@api_router.post("/auth/register")
+@api_router.post("/auth/register", dependencies=[Depends(limit_auth)])
 async def register(user_data: UserCreate):
+    await auth_limiter.hit(f"email:{user_data.email.lower()}")
+    
     # Check if user already exists
-    existing_user = await db.users.find_one({"email": user_data.email})
+    existing_user = await db.users.find_one({"email": user_data.email, "deleted": False})
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
@@ -165,8 +1001,11 @@ async def register(user_data: UserCreate):
     
     user_dict = user.dict()
     user_dict["password"] = hash_password(user_data.password)
+    user_dict["deleted"] = False
     
     await db.users.insert_one(user_dict)
+    _user_count_cache.clear()
+    dashboard.user_added()
     
     # Log activity
     activity = ActivityLog(
@@ -174,13 +1013,15 @@ async def register(user_data: UserCreate):
         user_email=user_data.email,
         details={"name": user_data.name, "role": "user"}
     )
-    await db.activity_logs.insert_one(activity.dict())
+    await log_activity(activity)
     
     return {"message": "User registered successfully", "user": user}
 
-@api_router.post("/auth/login")
+@api_router.post("/auth/login", dependencies=[Depends(limit_auth)])
 async def login(login_data: UserLogin):
-    user_doc = await db.users.find_one({"email": login_data.email})
+    await auth_limiter.hit(f"email:{login_data.email.lower()}")
+    
+    user_doc = await db.users.find_one({"email": login_data.email, "deleted": False})
     if not user_doc or not verify_password(login_data.password, user_doc["password"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
@@ -192,26 +1033,60 @@ async def login(login_data: UserLogin):
         user_email=login_data.email,
         details={"name": user.name, "role": user.role}
     )
-    await db.activity_logs.insert_one(activity.dict())
+    await log_activity(activity)
     
     return {"message": "Login successful", "user": user}
 
 # Student Management Routes
 @api_router.get("/students")
-async def get_students(user_email: str = None):
+async def get_students(request: Request, include_results: bool = False, user_email: str = None):
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    # Cards only need the profile fields; results are loaded per student on demand
+    projection = STUDENT_RESULTS_PROJECTION if include_results else STUDENT_LIST_PROJECTION
+    if wants_ndjson(request):
+        return ndjson_response(
+            db.students.find({"deleted": False}, projection),
+            attach_semester_results if include_results else None
+        )
+    
+    students = await db.students.find({"deleted": False}, projection).to_list(200)
+    if include_results:
+        await attach_semester_results(students)
+    return JSONResponse(jsonable_encoder(students))
+
+@api_router.get("/students/{student_id}")
+async def get_student(student_id: str, user_email: str = None):
     if not user_email:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    students = await db.students.find().to_list(200)
-    return [Student(**student) for student in students]
+    student = await db.students.find_one({"id": student_id, "deleted": False}, {"_id": 0})
+    if not student:
+        raise HTTPException(status_code=404, detail="Student not found")
+    
+    await attach_semester_results([student])
+    return Student(**student)
+
+@api_router.get("/students/{student_id}/semesters/{semester}")
+async def get_student_semester(student_id: str, semester: str, user_email: str = None):
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    semester_result = await load_semester_result(student_id, semester)
+    if not semester_result:
+        raise HTTPException(status_code=404, detail="Semester result not found")
+    
+    return SemesterResult(**semester_result)
 
-@api_router.post("/students")
-async def create_student(student_data: StudentCreate, user_email: str = None):
+@api_router.post("/students", dependencies=[Depends(limit_writes)])
+@idempotent("create_student")
+async def create_student(student_data: StudentCreate, user_email: str = None, idempotency_key: Optional[str] = Header(None)):
     if not user_email:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
     # Check if roll number already exists
-    existing_student = await db.students.find_one({"roll_number": student_data.roll_number})
+    existing_student = await db.students.find_one({"roll_number": student_data.roll_number, "deleted": False})
     if existing_student:
         raise HTTPException(status_code=400, detail="Roll number already exists")
     
@@ -225,7 +1100,17 @@ async def create_student(student_data: StudentCreate, user_email: str = None):
     )
     
     student_dict = student.dict()
-    await db.students.insert_one(student_dict)
+    student_dict["history_version"] = 1
+    student_dict["deleted"] = False
+    try:
+        await db.students.insert_one(student_dict)
+    except DuplicateKeyError:
+        # Lost a race with a concurrent create; the unique index is the real check
+        raise HTTPException(status_code=400, detail="Roll number already exists")
+    dashboard.student_added(student.stream, student.current_semester)
+    await record_student_version(
+        student.id, 1, "STUDENT_CREATED", user_email, history_state(student_dict), student_dict, student.created_at
+    )
     
     # Log activity
     activity = ActivityLog(
@@ -235,24 +1120,51 @@ async def create_student(student_data: StudentCreate, user_email: str = None):
         student_name=student.name,
         details={"roll_number": student.roll_number, "stream": student.stream}
     )
-    await db.activity_logs.insert_one(activity.dict())
+    await log_activity(activity)
     
     return student
 
-@api_router.put("/students/{student_id}")
-async def update_student(student_id: str, student_data: StudentUpdate, user_email: str = None):
+@api_router.put("/students/{student_id}", dependencies=[Depends(limit_writes)])
+@idempotent("update_student")
+async def update_student(student_id: str, student_data: StudentUpdate, user_email: str = None, idempotency_key: Optional[str] = Header(None)):
     if not user_email:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    existing_student = await db.students.find_one({"id": student_id})
-    if not existing_student:
-        raise HTTPException(status_code=404, detail="Student not found")
-    
     update_data = {k: v for k, v in student_data.dict().items() if v is not None}
     update_data["updated_at"] = datetime.utcnow()
     update_data["updated_by"] = user_email
     
-    await db.students.update_one({"id": student_id}, {"$set": update_data})
+    # The diff is taken against the document this update replaced, so
+    # concurrent updates each record exactly what they changed
+    try:
+        existing_student = await db.students.find_one_and_update(
+            {"id": student_id, "deleted": False},
+            {"$set": update_data, "$inc": {"history_version": 1}},
+            return_document=ReturnDocument.BEFORE
+        )
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Roll number already exists")
+    if not existing_student:
+        raise HTTPException(status_code=404, detail="Student not found")
+    updated_student = {
+        **existing_student,
+        **update_data,
+        "history_version": existing_student.get("history_version", 0) + 1
+    }
+    
+    changes = {
+        k: v for k, v in update_data.items()
+        if k not in HISTORY_UNTRACKED_FIELDS and existing_student.get(k) != v
+    }
+    await record_student_version(
+        student_id, updated_student["history_version"], "STUDENT_UPDATED", user_email, changes,
+        updated_student, update_data["updated_at"]
+    )
+    dashboard.student_removed(existing_student["stream"], existing_student["current_semester"])
+    dashboard.student_added(
+        update_data.get("stream", existing_student["stream"]),
+        update_data.get("current_semester", existing_student["current_semester"])
+    )
     
     # Log activity
     activity = ActivityLog(
@@ -262,26 +1174,32 @@ async def update_student(student_id: str, student_data: StudentUpdate, user_emai
         student_name=existing_student["name"],
         details=update_data
     )
-    await db.activity_logs.insert_one(activity.dict())
+    await log_activity(activity)
     
-    updated_student = await db.students.find_one({"id": student_id})
     return Student(**updated_student)
 
-@api_router.delete("/students/{student_id}")
+@api_router.delete("/students/{student_id}", dependencies=[Depends(limit_writes)])
 async def delete_student(student_id: str, user_email: str = None):
     if not user_email:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
     # Check if user is admin
-    user_doc = await db.users.find_one({"email": user_email})
+    user_doc = await db.users.find_one({"email": user_email, "deleted": False})
     if not user_doc or user_doc["role"] != "admin":
         raise HTTPException(status_code=403, detail="Only admins can delete students")
     
-    existing_student = await db.students.find_one({"id": student_id})
+    # Soft delete; the purge task removes results, history and photo later
+    job = await create_deletion_job("students", {"id": student_id}, user_email)
+    existing_student = await db.students.find_one_and_update(
+        {"id": student_id, "deleted": False},
+        deletion_marker(job),
+        projection={"_id": 0, "name": 1, "roll_number": 1, "stream": 1, "current_semester": 1}
+    )
+    await set_deletion_total(job, 1 if existing_student else 0)
     if not existing_student:
         raise HTTPException(status_code=404, detail="Student not found")
     
-    await db.students.delete_one({"id": student_id})
+    dashboard.student_removed(existing_student["stream"], existing_student["current_semester"])
     
     # Log activity
     activity = ActivityLog(
@@ -289,43 +1207,44 @@ async def delete_student(student_id: str, user_email: str = None):
         user_email=user_email,
         student_id=student_id,
         student_name=existing_student["name"],
-        details={"roll_number": existing_student["roll_number"]}
+        details={"roll_number": existing_student["roll_number"], "deletion_id": job.id}
     )
-    await db.activity_logs.insert_one(activity.dict())
+    await log_activity(activity)
     
-    return {"message": "Student deleted successfully"}
+    return {"message": "Student deleted successfully", "deletion_id": job.id}
 
-@api_router.put("/students/{student_id}/subjects")
-async def update_student_subjects(student_id: str, subject_data: SubjectUpdate, user_email: str = None):
+@api_router.put("/students/{student_id}/subjects", dependencies=[Depends(limit_writes)])
+@idempotent("update_student_subjects")
+async def update_student_subjects(student_id: str, subject_data: SubjectUpdate, user_email: str = None, idempotency_key: Optional[str] = Header(None)):
     if not user_email:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    existing_student = await db.students.find_one({"id": student_id})
+    existing_student = await db.students.find_one({"id": student_id, "deleted": False})
     if not existing_student:
         raise HTTPException(status_code=404, detail="Student not found")
     
-    # Calculate grades for subjects
+    # Calculate grades for subjects using the stream's grading scheme
+    scheme = await get_grading_scheme(existing_student["stream"])
     for subject in subject_data.subjects:
-        subject.grade = calculate_grade(subject.marks)
+        subject.grade = scheme.grade(subject.marks)
+        subject.passed = scheme.passes(subject.marks)
     
     # Create new semester result
     semester_result = SemesterResult(
         semester=subject_data.semester,
-        subjects=subject_data.subjects
+        subjects=subject_data.subjects,
+        grading_scheme=scheme.scheme_id
     )
     
-    # Update student's semester results
-    student_obj = Student(**existing_student)
-    
-    # Remove existing result for this semester if it exists
-    student_obj.semester_results = [sr for sr in student_obj.semester_results if sr.semester != subject_data.semester]
-    
-    # Add new result
-    student_obj.semester_results.append(semester_result)
-    student_obj.updated_at = datetime.utcnow()
-    student_obj.updated_by = user_email
-    
-    await db.students.update_one({"id": student_id}, {"$set": student_obj.dict()})
+    # Replace any existing result for this semester
+    student = await save_semester_result(student_id, semester_result, user_email)
+    if student is None:
+        raise HTTPException(status_code=404, detail="Student not found")
+    await invalidate_analytics(existing_student["stream"], subject_data.semester)
+    await record_student_version(
+        student_id, student["history_version"], "STUDENT_SUBJECTS_UPDATED", user_email,
+        {"semester_results": {semester_result.semester: semester_result.dict()}}, student
+    )
     
     # Log activity
     activity = ActivityLog(
@@ -335,65 +1254,119 @@ async def update_student_subjects(student_id: str, subject_data: SubjectUpdate,
         student_name=existing_student["name"],
         details={"semester": subject_data.semester, "subjects_count": len(subject_data.subjects)}
     )
-    await db.activity_logs.insert_one(activity.dict())
+    await log_activity(activity)
     
     return {"message": "Subjects updated successfully"}
 
+# Dashboard Routes
+@api_router.get("/dashboard/summary")
+async def get_dashboard_summary(user_email: str = None):
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    user_doc = await db.users.find_one({"email": user_email, "deleted": False})
+    if not user_doc:
+        raise HTTPException(status_code=401, detail="User not found")
+    
+    if not dashboard.loaded:
+        await dashboard.reconcile()
+    return dashboard.summary(include_admin=user_doc["role"] == "admin")
+
 # User Management Routes (Admin only)
 @api_router.get("/users")
-async def get_users(user_email: str = None):
+async def get_users(
+    request: Request,
+    role: Optional[str] = None,
+    email_prefix: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    user_email: str = None
+):
     if not user_email:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
     # Check if user is admin
-    user_doc = await db.users.find_one({"email": user_email})
+    user_doc = await db.users.find_one({"email": user_email, "deleted": False})
     if not user_doc or user_doc["role"] != "admin":
         raise HTTPException(status_code=403, detail="Only admins can view users")
     
-    users = await db.users.find({}, {"password": 0}).to_list(1000)
-    return [User(**user) for user in users]
+    user_filter = user_directory_filter(role, email_prefix)
+    if cursor:
+        user_filter["email"] = {**user_filter.get("email", {}), "$gt": decode_cursor(cursor)}
+    
+    # Streaming clients get everything after the cursor rather than one page
+    if wants_ndjson(request):
+        return ndjson_response(db.users.find(user_filter, USER_PROJECTION).sort("email", 1))
+    
+    users = await db.users.find(user_filter, USER_PROJECTION).sort("email", 1).limit(limit + 1).to_list(limit + 1)
+    headers = {}
+    if len(users) > limit:
+        users = users[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(users[-1]["email"])
+    
+    # Documents are already shaped by the projection, so skip model validation
+    return JSONResponse(jsonable_encoder(users), headers=headers)
+
+@api_router.get("/users/count")
+async def get_users_count(role: Optional[str] = None, email_prefix: Optional[str] = None, user_email: str = None):
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    # Check if user is admin
+    user_doc = await db.users.find_one({"email": user_email, "deleted": False})
+    if not user_doc or user_doc["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can view users")
+    
+    return {"count": await count_users(role, email_prefix)}
 
-@api_router.delete("/users/{user_id}")
+@api_router.delete("/users/{user_id}", dependencies=[Depends(limit_writes)])
 async def delete_user(user_id: str, user_email: str = None):
     if not user_email:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
     # Check if user is admin
-    user_doc = await db.users.find_one({"email": user_email})
+    user_doc = await db.users.find_one({"email": user_email, "deleted": False})
     if not user_doc or user_doc["role"] != "admin":
         raise HTTPException(status_code=403, detail="Only admins can delete users")
     
-    target_user = await db.users.find_one({"id": user_id})
-    if not target_user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
     # Don't allow admin to delete themselves
-    if target_user["email"] == user_email:
+    if user_doc["id"] == user_id:
         raise HTTPException(status_code=400, detail="Cannot delete your own account")
     
-    await db.users.delete_one({"id": user_id})
+    job = await create_deletion_job("users", {"id": user_id}, user_email)
+    target_user = await db.users.find_one_and_update(
+        {"id": user_id, "deleted": False},
+        deletion_marker(job),
+        projection={"_id": 0, "email": 1, "name": 1}
+    )
+    await set_deletion_total(job, 1 if target_user else 0)
+    if not target_user:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    _user_count_cache.clear()
+    dashboard.user_removed()
     
     # Log activity
     activity = ActivityLog(
         action="USER_DELETED",
         user_email=user_email,
-        details={"deleted_user": target_user["email"], "deleted_name": target_user["name"]}
+        details={"deleted_user": target_user["email"], "deleted_name": target_user["name"], "deletion_id": job.id}
     )
-    await db.activity_logs.insert_one(activity.dict())
+    await log_activity(activity)
     
-    return {"message": "User deleted successfully"}
+    return {"message": "User deleted successfully", "deletion_id": job.id}
 
-@api_router.put("/users/{user_id}/role")
+@api_router.put("/users/{user_id}/role", dependencies=[Depends(limit_writes)])
 async def update_user_role(user_id: str, role_data: dict, user_email: str = None):
     if not user_email:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
     # Check if user is admin
-    user_doc = await db.users.find_one({"email": user_email})
+    user_doc = await db.users.find_one({"email": user_email, "deleted": False})
     if not user_doc or user_doc["role"] != "admin":
         raise HTTPException(status_code=403, detail="Only admins can update user roles")
     
-    target_user = await db.users.find_one({"id": user_id})
+    target_user = await db.users.find_one({"id": user_id, "deleted": False})
     if not target_user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -402,6 +1375,7 @@ async def update_user_role(user_id: str, role_data: dict, user_email: str = None
         raise HTTPException(status_code=400, detail="Invalid role")
     
     await db.users.update_one({"id": user_id}, {"$set": {"role": new_role}})
+    _user_count_cache.clear()
     
     # Log activity
     activity = ActivityLog(
@@ -409,16 +1383,16 @@ async def update_user_role(user_id: str, role_data: dict, user_email: str = None
         user_email=user_email,
         details={"target_user": target_user["email"], "old_role": target_user["role"], "new_role": new_role}
     )
-    await db.activity_logs.insert_one(activity.dict())
+    await log_activity(activity)
     
     return {"message": "User role updated successfully"}
 
-@api_router.put("/users/profile")
+@api_router.put("/users/profile", dependencies=[Depends(limit_writes)])
 async def update_profile(profile_data: dict, user_email: str = None):
     if not user_email:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    user_doc = await db.users.find_one({"email": user_email})
+    user_doc = await db.users.find_one({"email": user_email, "deleted": False})
     if not user_doc:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -434,14 +1408,14 @@ async def update_profile(profile_data: dict, user_email: str = None):
     if "email" in profile_data:
         # Check if new email is already taken
         if profile_data["email"] != user_email:
-            existing_user = await db.users.find_one({"email": profile_data["email"]})
+            existing_user = await db.users.find_one({"email": profile_data["email"], "deleted": False})
             if existing_user:
                 raise HTTPException(status_code=400, detail="Email already in use")
         update_data["email"] = profile_data["email"]
     if "newPassword" in profile_data and profile_data["newPassword"]:
         update_data["password"] = hash_password(profile_data["newPassword"])
     
-    await db.users.update_one({"email": user_email}, {"$set": update_data})
+    await db.users.update_one({"email": user_email, "deleted": False}, {"$set": update_data})
     
     # Log activity
     activity = ActivityLog(
@@ -449,24 +1423,105 @@ async def update_profile(profile_data: dict, user_email: str = None):
         user_email=user_email,
         details={"updated_fields": list(update_data.keys())}
     )
-    await db.activity_logs.insert_one(activity.dict())
+    await log_activity(activity)
     
     return {"message": "Profile updated successfully"}
 
 # Activity Logs (Admin only)
 @api_router.get("/activity-logs")
-async def get_activity_logs(user_email: str = None):
+async def get_activity_logs(request: Request, user_email: str = None):
     if not user_email:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
     # Check if user is admin
-    user_doc = await db.users.find_one({"email": user_email})
+    user_doc = await db.users.find_one({"email": user_email, "deleted": False})
     if not user_doc or user_doc["role"] != "admin":
         raise HTTPException(status_code=403, detail="Only admins can view activity logs")
     
+    if wants_ndjson(request):
+        return ndjson_response(db.activity_logs.find({}, {"_id": 0}).sort("timestamp", -1))
+    
     logs = await db.activity_logs.find().sort("timestamp", -1).to_list(100)
     return [ActivityLog(**log) for log in logs]
 
+# Health Routes
+# Liveness only says the process is serving; readiness also waits for startup
+# (flag backfill, indexes, admin user) to finish and for Mongo to answer a ping.
+_startup_complete = False
+
+@api_router.get("/health/live")
+async def liveness():
+    return {"status": "ok"}
+
+@api_router.get("/health/ready")
+async def readiness():
+    if not _startup_complete:
+        return JSONResponse(status_code=503, content={"status": "starting"})
+    try:
+        await asyncio.wait_for(db.command("ping"), timeout=2)
+    except Exception:
+        return JSONResponse(status_code=503, content={"status": "database unavailable"})
+    return {"status": "ready"}
+
+# Feature routers
+# Less frequently used features live in their own modules and are imported on
+# the first request that matches one of their paths, keeping them (and the
+# libraries they pull in) off the cold-start path.
+FEATURE_ROUTERS = {
+    "reports": [r"^/api/students/[^/]+/report$", r"^/api/reports/"],
+    "grading": [r"^/api/grading-schemes"],
+    "photos": [r"^/api/students/[^/]+/photo$", r"^/api/photos/"],
+    "history": [r"^/api/students/[^/]+/(versions|as-of)"],
+    "deletions": [r"^/api/(students|users)/bulk-delete$", r"^/api/deletions"],
+    "analytics": [r"^/api/analytics/"],
+}
+_feature_patterns = {name: [re.compile(pattern) for pattern in patterns] for name, patterns in FEATURE_ROUTERS.items()}
+_loaded_features = set()
+
+async def load_feature(name: str):
+    if name in _loaded_features:
+        return
+    # Import off the event loop so a cold import does not stall other requests
+    module = await asyncio.to_thread(importlib.import_module, name)
+    if name not in _loaded_features:
+        app.include_router(module.router)
+        _loaded_features.add(name)
+        app.openapi_schema = None
+
+@app.middleware("http")
+async def load_feature_routers(request: Request, call_next):
+    path = request.url.path
+    if path in (app.openapi_url, app.docs_url, app.redoc_url):
+        for name in FEATURE_ROUTERS:
+            await load_feature(name)
+    else:
+        for name, patterns in _feature_patterns.items():
+            if name not in _loaded_features and any(pattern.match(path) for pattern in patterns):
+                await load_feature(name)
+    return await call_next(request)
+
+# Admission control
+# Shed load once too many requests are in flight instead of letting them queue
+# on Mongo until clients time out.
+_in_flight_requests = 0
+
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    global _in_flight_requests
+    if request.url.path.startswith("/api/health/"):
+        return await call_next(request)
+    if _in_flight_requests >= MAX_IN_FLIGHT_REQUESTS:
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Server is busy, please retry"},
+            headers={"Retry-After": "1"}
+        )
+    _in_flight_requests += 1
+    try:
+        return await call_next(request)
+    finally:
+        _in_flight_requests -= 1
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -476,6 +1531,7 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Configure logging
@@ -485,10 +1541,91 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+async def backfill_deleted_flags():
+    # Documents written before soft deletes have no flag and would be
+    # invisible to `deleted: False` queries
+    await asyncio.gather(
+        db.students.update_many({"deleted": {"$exists": False}}, {"$set": {"deleted": False}}),
+        db.users.update_many({"deleted": {"$exists": False}}, {"$set": {"deleted": False}}),
+    )
+
+async def create_live_index(collection, keys, name: str, replaces: Optional[str] = None, **kwargs):
+    # Partial index over live documents; `replaces` names the full index it supersedes
+    if replaces:
+        try:
+            await collection.drop_index(replaces)
+        except OperationFailure:
+            pass
+    await collection.create_index(keys, name=name, partialFilterExpression={"deleted": False}, **kwargs)
+
+async def create_roll_number_index():
+    # Unique among live students only, so a deleted student's roll number can be reused
+    try:
+        await create_live_index(db.students, "roll_number", "roll_number_live", replaces="roll_number_1", unique=True)
+    except OperationFailure:
+        logger.warning("Duplicate roll numbers exist; roll_number unique index not created")
+
+async def ensure_indexes():
+    indexes = [
+        create_roll_number_index(),
+        db.idempotency_keys.create_index("key", unique=True),
+        db.idempotency_keys.create_index("created_at", expireAfterSeconds=IDEMPOTENCY_TTL),
+        db.grading_schemes.create_index([("stream", 1), ("version", -1)], unique=True),
+        db.results.create_index([("student_id", 1), ("semester", 1)], unique=True),
+        db.results.create_index("semester"),
+        db.student_versions.create_index([("student_id", 1), ("version", 1)], unique=True),
+        db.student_versions.create_index([("student_id", 1), ("timestamp", 1)]),
+        create_live_index(db.students, [("stream", 1), ("current_semester", 1)], "stream_semester_live"),
+        create_live_index(db.users, "email", "email_live", replaces="email_1"),
+        create_live_index(db.users, [("role", 1), ("email", 1)], "role_email_live", replaces="role_1_email_1"),
+        db.students.create_index("deletion_id", partialFilterExpression={"deleted": True}),
+        db.users.create_index("deletion_id", partialFilterExpression={"deleted": True}),
+        db.deletion_jobs.create_index("id", unique=True),
+        db.deletion_jobs.create_index([("status", 1), ("purge_after", 1)]),
+        db.deletion_jobs.create_index("created_at"),
+        db.analytics_cache.create_index([("stream", 1), ("semester", 1)], unique=True),
+        db.analytics_jobs.create_index("id", unique=True),
+        db.analytics_jobs.create_index("created_at", expireAfterSeconds=ANALYTICS_JOB_TTL),
+    ]
+    if RATE_LIMIT_BACKEND == "mongo":
+        indexes += [
+            db.rate_limits.create_index("key", unique=True),
+            db.rate_limits.create_index("expires_at", expireAfterSeconds=0),
+        ]
+    await asyncio.gather(*indexes)
+
+async def prepare_database():
+    global _startup_complete, _dashboard_task, _purge_task
+    delay = 1
+    while True:
+        try:
+            await backfill_deleted_flags()
+            await ensure_indexes()
+            await init_admin()
+            break
+        except Exception:
+            logger.exception("Database preparation failed, retrying in %ss", delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+    _dashboard_task = asyncio.create_task(reconcile_dashboard_periodically())
+    _purge_task = asyncio.create_task(purge_deletions_periodically())
+    _startup_complete = True
+
+_startup_task: Optional[asyncio.Task] = None
+
 @app.on_event("startup")
 async def startup_event():
-    await init_admin()
+    # Start serving immediately; /api/health/ready reports when this finishes
+    global _startup_task
+    _startup_task = asyncio.create_task(prepare_database())
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    global _process_pool
+    for task in (_startup_task, _dashboard_task, _purge_task):
+        if task is not None:
+            task.cancel()
+    client.close()
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False)
+        _process_pool = None
\ No newline at end of file
@@ -0,0 +1,93 @@
+"""Measure server cold start and fail when it exceeds the budget.
+
+Reports the cumulative import time of ``server`` (via ``python -X importtime``)
+and the time from launching uvicorn until /api/health/live answers and until
+/api/health/ready returns 200. Readiness includes connecting to MongoDB and
+creating indexes, so point MONGO_URL and DB_NAME at a test database.
+
+    python startup_benchmark.py --import-budget 1.0 --ready-budget 3.0
+"""
+import argparse
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+from typing import Tuple
+
+ROOT_DIR = Path(__file__).parent
+
+
+def measure_import_time() -> float:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server"],
+        cwd=ROOT_DIR, capture_output=True, text=True, check=True,
+    )
+    for line in reversed(result.stderr.splitlines()):
+        match = re.match(r"import time:\s*\d+\s*\|\s*(\d+)\s*\|\s*server$", line)
+        if match:
+            return int(match.group(1)) / 1_000_000
+    raise RuntimeError("server import not found in -X importtime output")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_time_to_ready(timeout: float) -> Tuple[float, float]:
+    # Returns (seconds until /api/health/live, seconds until /api/health/ready)
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT_DIR,
+    )
+    timings = []
+    try:
+        for path in ("/api/health/live", "/api/health/ready"):
+            url = f"http://127.0.0.1:{port}{path}"
+            while True:
+                if time.perf_counter() - started >= timeout:
+                    raise RuntimeError(f"{path} did not return 200 within {timeout}s")
+                if process.poll() is not None:
+                    raise RuntimeError(f"uvicorn exited with code {process.returncode}")
+                try:
+                    # Not ready yet answers 503, which urlopen raises as an HTTPError
+                    with urllib.request.urlopen(url, timeout=1) as response:
+                        if response.status == 200:
+                            timings.append(time.perf_counter() - started)
+                            break
+                except OSError:
+                    time.sleep(0.05)
+        return timings[0], timings[1]
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--import-budget", type=float, default=float(os.environ.get("IMPORT_BUDGET_SECONDS", "1.0")))
+    parser.add_argument("--ready-budget", type=float, default=float(os.environ.get("READY_BUDGET_SECONDS", "3.0")))
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    import_time = measure_import_time()
+    live_time, ready_time = measure_time_to_ready(args.timeout)
+    print(f"import server:         {import_time:.3f}s (budget {args.import_budget:.3f}s)")
+    print(f"time to /health/live:  {live_time:.3f}s")
+    print(f"time to /health/ready: {ready_time:.3f}s (budget {args.ready_budget:.3f}s)")
+
+    over_budget = import_time > args.import_budget or ready_time > args.ready_budget
+    if over_budget:
+        print("Startup is over budget", file=sys.stderr)
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
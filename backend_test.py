@@ -162,6 +162,38 @@ class BackendTester:
             self.log_result("Create Student", False, f"Exception during student creation: {str(e)}")
             return False
     
+    def test_upload_student_photo(self):
+        """Test multipart photo upload and serving the re-encoded image"""
+        if not self.test_student_id:
+            self.log_result("Upload Student Photo", False, "No test student ID available")
+            return False
+            
+        try:
+            png_bytes = base64.b64decode("iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChAI9jU77mgAAAABJRU5ErkJggg==")
+            response = self.session.post(
+                f"{BACKEND_URL}/students/{self.test_student_id}/photo",
+                files={"photo": ("photo.png", png_bytes, "image/png")},
+                params={"user_email": self.admin_user["email"]}
+            )
+            
+            if response.status_code != 200 or "photo" not in response.json():
+                self.log_result("Upload Student Photo", False, f"Photo upload failed with status {response.status_code}", response.text)
+                return False
+            
+            photo_url = BACKEND_URL[:-len("/api")] + response.json()["photo"]
+            response = self.session.get(photo_url)
+            
+            if response.status_code == 200 and response.headers.get("content-type", "").startswith("image/"):
+                self.log_result("Upload Student Photo", True, f"Photo stored and served as {response.headers['content-type']}")
+                return True
+            else:
+                self.log_result("Upload Student Photo", False, f"Photo fetch failed with status {response.status_code}", response.text[:200])
+                return False
+                
+        except Exception as e:
+            self.log_result("Upload Student Photo", False, f"Exception during photo upload: {str(e)}")
+            return False
+    
     def test_roll_number_uniqueness(self):
         """Test roll number uniqueness validation"""
         try:
@@ -189,6 +221,45 @@ class BackendTester:
             self.log_result("Roll Number Uniqueness", False, f"Exception during uniqueness test: {str(e)}")
             return False
     
+    def test_idempotent_create_student(self):
+        """Test that retrying a create with the same Idempotency-Key replays the first response"""
+        try:
+            student_data = {
+                "name": "Idempotency Test",
+                "roll_number": f"IDEM{int(time.time())}",
+                "stream": "Backend Test Stream",
+                "current_semester": "1"
+            }
+            headers = {"Idempotency-Key": f"backend-test-{time.time()}"}
+            
+            first = self.session.post(
+                f"{BACKEND_URL}/students",
+                json=student_data,
+                headers=headers,
+                params={"user_email": self.admin_user["email"]}
+            )
+            retry = self.session.post(
+                f"{BACKEND_URL}/students",
+                json=student_data,
+                headers=headers,
+                params={"user_email": self.admin_user["email"]}
+            )
+            
+            if first.status_code == 200 and retry.status_code == 200 and first.json()["id"] == retry.json()["id"]:
+                self.session.delete(
+                    f"{BACKEND_URL}/students/{first.json()['id']}",
+                    params={"user_email": self.admin_user["email"]}
+                )
+                self.log_result("Idempotent Create Student", True, "Retry replayed the original student instead of writing again")
+                return True
+            else:
+                self.log_result("Idempotent Create Student", False, f"Expected identical responses, got {first.status_code} and {retry.status_code}", retry.text)
+                return False
+                
+        except Exception as e:
+            self.log_result("Idempotent Create Student", False, f"Exception during idempotency test: {str(e)}")
+            return False
+    
     def test_get_students(self):
         """Test retrieving students list"""
         try:
@@ -213,6 +284,68 @@ class BackendTester:
             self.log_result("Get Students", False, f"Exception during get students: {str(e)}")
             return False
     
+    def test_get_students_ndjson(self):
+        """Test streaming the students list as NDJSON"""
+        try:
+            response = self.session.get(
+                f"{BACKEND_URL}/students",
+                headers={"Accept": "application/x-ndjson"},
+                params={"user_email": self.admin_user["email"]}
+            )
+            
+            if response.status_code == 200 and response.headers.get("content-type", "").startswith("application/x-ndjson"):
+                rows = [json.loads(line) for line in response.text.splitlines() if line]
+                self.log_result("Get Students NDJSON", True, f"Streamed {len(rows)} students as NDJSON")
+                return True
+            else:
+                self.log_result("Get Students NDJSON", False, f"NDJSON request failed with status {response.status_code}", response.text[:200])
+                return False
+                
+        except Exception as e:
+            self.log_result("Get Students NDJSON", False, f"Exception during NDJSON streaming: {str(e)}")
+            return False
+    
+    def test_health_checks(self):
+        """Test liveness and readiness endpoints"""
+        try:
+            live = self.session.get(f"{BACKEND_URL}/health/live")
+            ready = self.session.get(f"{BACKEND_URL}/health/ready")
+            
+            if live.status_code == 200 and ready.status_code == 200:
+                self.log_result("Health Checks", True, "Server is live and ready")
+                return True
+            else:
+                self.log_result("Health Checks", False, f"Health checks returned live={live.status_code} ready={ready.status_code}", ready.text)
+                return False
+                
+        except Exception as e:
+            self.log_result("Health Checks", False, f"Exception during health checks: {str(e)}")
+            return False
+    
+    def test_dashboard_summary(self):
+        """Test dashboard summary counters"""
+        try:
+            response = self.session.get(
+                f"{BACKEND_URL}/dashboard/summary",
+                params={"user_email": self.admin_user["email"]}
+            )
+            
+            if response.status_code == 200:
+                data = response.json()
+                if data.get("total_students", 0) >= 1 and "students_per_stream" in data:
+                    self.log_result("Dashboard Summary", True, f"Summary reports {data['total_students']} students and {data['total_users']} users")
+                    return True
+                else:
+                    self.log_result("Dashboard Summary", False, "Summary missing expected counters", data)
+                    return False
+            else:
+                self.log_result("Dashboard Summary", False, f"Dashboard summary failed with status {response.status_code}", response.text)
+                return False
+                
+        except Exception as e:
+            self.log_result("Dashboard Summary", False, f"Exception during dashboard summary: {str(e)}")
+            return False
+    
     def test_update_student(self):
         """Test student update functionality"""
         if not self.test_student_id:
@@ -281,6 +414,138 @@ class BackendTester:
             self.log_result("Update Student Subjects", False, f"Exception during subject update: {str(e)}")
             return False
     
+    def test_student_semester(self):
+        """Test that the list omits semester results and a single semester loads on demand"""
+        if not self.test_student_id:
+            self.log_result("Student Semester", False, "No test student ID available")
+            return False
+            
+        try:
+            response = self.session.get(
+                f"{BACKEND_URL}/students",
+                params={"user_email": self.admin_user["email"]}
+            )
+            
+            if response.status_code != 200 or any("semester_results" in s for s in response.json()):
+                self.log_result("Student Semester", False, "Student list should not include semester results", response.text[:200])
+                return False
+            
+            response = self.session.get(
+                f"{BACKEND_URL}/students/{self.test_student_id}/semesters/1",
+                params={"user_email": self.admin_user["email"]}
+            )
+            
+            if response.status_code == 200 and len(response.json().get("subjects", [])) == 4:
+                self.log_result("Student Semester", True, "Semester 1 loaded separately with 4 subjects")
+                return True
+            else:
+                self.log_result("Student Semester", False, f"Semester fetch failed with status {response.status_code}", response.text)
+                return False
+                
+        except Exception as e:
+            self.log_result("Student Semester", False, f"Exception during semester fetch: {str(e)}")
+            return False
+    
+    def test_student_history(self):
+        """Test version history and reading the first version back"""
+        if not self.test_student_id:
+            self.log_result("Student History", False, "No test student ID available")
+            return False
+            
+        try:
+            response = self.session.get(
+                f"{BACKEND_URL}/students/{self.test_student_id}/versions",
+                params={"user_email": self.admin_user["email"]}
+            )
+            
+            if response.status_code != 200 or len(response.json()) < 2:
+                self.log_result("Student History", False, "Expected at least a create and an update version", response.text[:200])
+                return False
+            
+            response = self.session.get(
+                f"{BACKEND_URL}/students/{self.test_student_id}/versions/1",
+                params={"user_email": self.admin_user["email"]}
+            )
+            
+            if response.status_code == 200 and response.json().get("action") == "STUDENT_CREATED":
+                self.log_result("Student History", True, f"Version 1 reconstructed for {response.json()['student']['name']}")
+                return True
+            else:
+                self.log_result("Student History", False, f"Version fetch failed with status {response.status_code}", response.text)
+                return False
+                
+        except Exception as e:
+            self.log_result("Student History", False, f"Exception during history fetch: {str(e)}")
+            return False
+    
+    def test_stream_analytics(self):
+        """Test semester trend analytics for the test student's stream"""
+        try:
+            response = self.session.get(
+                f"{BACKEND_URL}/analytics/trends",
+                params={"user_email": self.admin_user["email"], "stream": "Computer Science & Engineering"}
+            )
+            
+            # Large cohorts are computed in the background; poll the job then ask again
+            if response.status_code == 202:
+                job_id = response.json()["id"]
+                for _ in range(30):
+                    job = self.session.get(
+                        f"{BACKEND_URL}/analytics/jobs/{job_id}",
+                        params={"user_email": self.admin_user["email"]}
+                    ).json()
+                    if job["status"] in ("done", "failed"):
+                        break
+                    time.sleep(1)
+                response = self.session.get(
+                    f"{BACKEND_URL}/analytics/trends",
+                    params={"user_email": self.admin_user["email"], "stream": "Computer Science & Engineering"}
+                )
+            
+            if response.status_code == 200 and response.json().get("semesters"):
+                subjects = response.json()["semesters"][0]["subjects"]
+                self.log_result("Stream Analytics", True, f"Trends computed for {len(subjects)} subjects")
+                return True
+            else:
+                self.log_result("Stream Analytics", False, f"Analytics failed with status {response.status_code}", response.text)
+                return False
+                
+        except Exception as e:
+            self.log_result("Stream Analytics", False, f"Exception during analytics: {str(e)}")
+            return False
+    
+    def test_student_report(self):
+        """Test report card rendering for a single student and a batch"""
+        if not self.test_student_id:
+            self.log_result("Student Report", False, "No test student ID available")
+            return False
+            
+        try:
+            response = self.session.get(
+                f"{BACKEND_URL}/students/{self.test_student_id}/report",
+                params={"user_email": self.admin_user["email"], "format": "pdf", "semester": "1"}
+            )
+            
+            if response.status_code != 200 or not response.content.startswith(b"%PDF"):
+                self.log_result("Student Report", False, f"PDF report failed with status {response.status_code}", response.text[:200])
+                return False
+            
+            response = self.session.get(
+                f"{BACKEND_URL}/reports/batch",
+                params={"user_email": self.admin_user["email"], "stream": "Computer Science & Engineering", "semester": "1"}
+            )
+            
+            if response.status_code == 200 and response.headers.get("content-type") == "application/zip":
+                self.log_result("Student Report", True, "Single and batch report cards rendered successfully")
+                return True
+            else:
+                self.log_result("Student Report", False, f"Batch report failed with status {response.status_code}", response.text[:200])
+                return False
+                
+        except Exception as e:
+            self.log_result("Student Report", False, f"Exception during report rendering: {str(e)}")
+            return False
+    
     def test_role_based_access_admin_endpoints(self):
         """Test admin-only endpoints with admin user"""
         try:
@@ -323,6 +588,69 @@ class BackendTester:
             self.log_result("Admin Access Test", False, f"Exception during admin access test: {str(e)}")
             return False
     
+    def test_users_pagination(self):
+        """Test paginated user directory and cached user count"""
+        try:
+            response = self.session.get(
+                f"{BACKEND_URL}/users",
+                params={"user_email": self.admin_user["email"], "limit": 1}
+            )
+            
+            if response.status_code != 200 or len(response.json()) != 1:
+                self.log_result("Users Pagination", False, f"Paged users request failed with status {response.status_code}", response.text)
+                return False
+            
+            count_response = self.session.get(
+                f"{BACKEND_URL}/users/count",
+                params={"user_email": self.admin_user["email"]}
+            )
+            
+            if count_response.status_code == 200 and count_response.json().get("count", 0) >= 1:
+                has_next = "X-Next-Cursor" in response.headers
+                self.log_result("Users Pagination", True, f"User directory paged (next cursor: {has_next}), count: {count_response.json()['count']}")
+                return True
+            else:
+                self.log_result("Users Pagination", False, f"User count failed with status {count_response.status_code}", count_response.text)
+                return False
+                
+        except Exception as e:
+            self.log_result("Users Pagination", False, f"Exception during users pagination test: {str(e)}")
+            return False
+    
+    def test_grading_scheme_regrade(self):
+        """Test creating a versioned grading scheme and regrading a semester with it"""
+        try:
+            response = self.session.post(
+                f"{BACKEND_URL}/grading-schemes",
+                json={
+                    "name": "Backend Test Pass/Fail",
+                    "stream": "Backend Test Stream",
+                    "boundaries": [{"min_marks": 0, "grade": "FAIL"}, {"min_marks": 50, "grade": "PASS"}]
+                },
+                params={"user_email": self.admin_user["email"]}
+            )
+            
+            if response.status_code != 200 or "version" not in response.json():
+                self.log_result("Grading Scheme Regrade", False, f"Scheme creation failed with status {response.status_code}", response.text)
+                return False
+            
+            response = self.session.post(
+                f"{BACKEND_URL}/grading-schemes/regrade",
+                json={"stream": "Backend Test Stream", "semester": "1"},
+                params={"user_email": self.admin_user["email"]}
+            )
+            
+            if response.status_code == 200 and "results_regraded" in response.json():
+                self.log_result("Grading Scheme Regrade", True, f"Regraded {response.json()['results_regraded']} results")
+                return True
+            else:
+                self.log_result("Grading Scheme Regrade", False, f"Regrade failed with status {response.status_code}", response.text)
+                return False
+                
+        except Exception as e:
+            self.log_result("Grading Scheme Regrade", False, f"Exception during grading scheme test: {str(e)}")
+            return False
+    
     def test_role_based_access_regular_user(self):
         """Test that regular users cannot access admin endpoints"""
         if not self.test_user:
@@ -399,6 +727,116 @@ class BackendTester:
             self.log_result("Admin Delete Student", False, f"Exception during admin delete student: {str(e)}")
             return False
     
+    def test_bulk_delete_and_undo(self):
+        """Test bulk soft delete by stream and undoing it"""
+        try:
+            stream = f"BULK-{int(time.time())}"
+            for i in range(2):
+                self.session.post(
+                    f"{BACKEND_URL}/students",
+                    params={"user_email": self.admin_user["email"]},
+                    json={"name": f"Bulk Student {i}", "roll_number": f"{stream}-{i}", "stream": stream}
+                )
+            
+            response = self.session.post(
+                f"{BACKEND_URL}/students/bulk-delete",
+                params={"user_email": self.admin_user["email"]},
+                json={"stream": stream}
+            )
+            
+            if response.status_code != 200 or response.json().get("total") != 2:
+                self.log_result("Bulk Delete And Undo", False, f"Bulk delete failed with status {response.status_code}", response.text)
+                return False
+            
+            deletion_id = response.json()["id"]
+            response = self.session.post(
+                f"{BACKEND_URL}/deletions/{deletion_id}/undo",
+                params={"user_email": self.admin_user["email"]}
+            )
+            
+            if response.status_code == 200 and response.json().get("restored") == 2:
+                # Clean up; the purge task removes them once the undo window closes
+                self.session.post(
+                    f"{BACKEND_URL}/students/bulk-delete",
+                    params={"user_email": self.admin_user["email"]},
+                    json={"stream": stream}
+                )
+                self.log_result("Bulk Delete And Undo", True, "Bulk deleted 2 students by stream and restored them")
+                return True
+            else:
+                self.log_result("Bulk Delete And Undo", False, f"Undo failed with status {response.status_code}", response.text)
+                return False
+                
+        except Exception as e:
+            self.log_result("Bulk Delete And Undo", False, f"Exception during bulk delete: {str(e)}")
+            return False
+    
+    def test_auth_rate_limit(self):
+        """Test that repeated failed logins are throttled with 429 and Retry-After"""
+        try:
+            for _ in range(30):
+                response = self.session.post(f"{BACKEND_URL}/auth/login", json={
+                    "email": "ratelimit@gcet.edu.in",
+                    "password": "wrong-password"
+                })
+                if response.status_code == 429:
+                    break
+            
+            if response.status_code == 429 and "Retry-After" in response.headers:
+                self.log_result("Auth Rate Limit", True, f"Login throttled with Retry-After: {response.headers['Retry-After']}s")
+                return True
+            else:
+                self.log_result("Auth Rate Limit", False, f"Expected 429 after repeated logins, got {response.status_code}", response.text)
+                return False
+                
+        except Exception as e:
+            self.log_result("Auth Rate Limit", False, f"Exception during rate limit test: {str(e)}")
+            return False
+    
+    def test_rate_limit_per_client(self):
+        """Test that clients behind the ingress get separate rate limit buckets"""
+        try:
+            # Every request reaches the deployed backend from the same ingress,
+            # so this exercises the client resolution in-process instead
+            import asyncio
+            from pathlib import Path
+            from fastapi import HTTPException
+            from starlette.requests import Request
+            sys.path.insert(0, str(Path(__file__).parent / "backend"))
+            import server
+            
+            def request_from(*forwarded):
+                headers = [(b"x-forwarded-for", ", ".join(forwarded).encode())] if forwarded else []
+                return Request({"type": "http", "headers": headers, "client": ("10.0.0.1", 40000)})
+            
+            async def failed_logins(limiter, request, attempts):
+                throttled = 0
+                for _ in range(attempts):
+                    try:
+                        await limiter.hit(f"client:{server.client_address(request)}")
+                    except HTTPException:
+                        throttled += 1
+                return throttled
+            
+            server.TRUSTED_PROXY_HOPS = 1
+            server._rate_limit_backend = server.InMemoryRateLimitBackend()
+            limiter = server.TokenBucketLimiter("auth-check", server.AUTH_RATE_CAPACITY, server.AUTH_RATE_PER_SECOND)
+            attempts = server.AUTH_RATE_CAPACITY + 1
+            first = asyncio.run(failed_logins(limiter, request_from("203.0.113.7"), attempts))
+            spoofed = asyncio.run(failed_logins(limiter, request_from("198.51.100.9", "203.0.113.7"), 1))
+            other = asyncio.run(failed_logins(limiter, request_from("203.0.113.8"), 1))
+            
+            if first == 1 and spoofed == 1 and other == 0:
+                self.log_result("Rate Limit Per Client", True, "Clients behind the ingress are throttled independently")
+                return True
+            else:
+                self.log_result("Rate Limit Per Client", False, f"Unexpected throttling: first={first} spoofed={spoofed} other={other}")
+                return False
+                
+        except Exception as e:
+            self.log_result("Rate Limit Per Client", False, f"Exception during per-client rate limit test: {str(e)}")
+            return False
+    
     def run_all_tests(self):
         """Run comprehensive backend tests"""
         print("🚀 Starting Comprehensive Backend Testing for Student Management System")
@@ -416,21 +854,39 @@ class BackendTester:
         print("\n👥 STUDENT MANAGEMENT TESTS")
         print("-" * 40)
         self.test_create_student()
+        self.test_upload_student_photo()
         self.test_roll_number_uniqueness()
+        self.test_idempotent_create_student()
         self.test_get_students()
+        self.test_get_students_ndjson()
+        self.test_dashboard_summary()
+        self.test_health_checks()
         self.test_update_student()
         self.test_update_student_subjects()
+        self.test_student_semester()
+        self.test_student_history()
+        self.test_student_report()
+        self.test_stream_analytics()
         
         # Role-based Access Tests
         print("\n🔐 ROLE-BASED ACCESS CONTROL TESTS")
         print("-" * 40)
         self.test_role_based_access_admin_endpoints()
+        self.test_users_pagination()
+        self.test_grading_scheme_regrade()
         self.test_role_based_access_regular_user()
         
         # Admin Operations Tests
         print("\n⚡ ADMIN OPERATIONS TESTS")
         print("-" * 40)
         self.test_admin_delete_student()
+        self.test_bulk_delete_and_undo()
+        
+        # Rate Limiting Tests (run last, they exhaust the auth bucket for this client)
+        print("\n🚦 RATE LIMITING TESTS")
+        print("-" * 40)
+        self.test_auth_rate_limit()
+        self.test_rate_limit_per_client()
         
         # Summary
         print("\n" + "=" * 80)
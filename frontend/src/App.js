@@ -5,6 +5,17 @@ import axios from 'axios';
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// Forms hold one key per submission and send it again when the same submission is
+// retried, so the server replays the first result instead of writing twice.
+// The key changes whenever the form contents change.
+const newIdempotencyKey = () => crypto.randomUUID();
+const idempotencyHeaders = (key) => ({ headers: { 'Idempotency-Key': key } });
+
+// Uploaded photos are served by the backend; older records still hold data URLs
+const photoSrc = (photo) => (photo && photo.startsWith('/api/') ? `${BACKEND_URL}${photo}` : photo);
+
+const USER_SEARCH_DEBOUNCE_MS = 300;
+
 // Auth Context
 const AuthContext = createContext();
 
@@ -205,6 +216,7 @@ const StudentModal = ({ student, isOpen, onClose, onUpdate }) => {
   const [activeTab, setActiveTab] = useState('details');
   const [subjects, setSubjects] = useState([]);
   const [currentSemester, setCurrentSemester] = useState('1');
+  const [semesterResults, setSemesterResults] = useState([]);
   const [isLoading, setIsLoading] = useState(false);
   const { user } = useAuth();
 
@@ -215,17 +227,54 @@ const StudentModal = ({ student, isOpen, onClose, onUpdate }) => {
     'Organizational Behavior', 'Project Management'
   ];
 
+  // The student list omits semester results, so load them when the modal opens
+  const fetchSemesterHistory = async () => {
+    try {
+      const response = await axios.get(`${API}/students/${student.id}?user_email=${user.email}`);
+      setSemesterResults(response.data.semester_results || []);
+    } catch (error) {
+      console.error('Error fetching semester history:', error);
+    }
+  };
+
+  const fetchSemesterSubjects = async (semester, signal) => {
+    try {
+      const response = await axios.get(`${API}/students/${student.id}/semesters/${semester}?user_email=${user.email}`, { signal });
+      setSubjects(response.data.subjects || []);
+    } catch (error) {
+      if (axios.isCancel(error)) return;
+      setSubjects(commonSubjects.slice(0, 6).map(name => ({ name, marks: 0, grade: 'F' })));
+    }
+  };
+
+  // Which student currentSemester was last set for, so subjects are never
+  // fetched with the semester left over from a previous student
+  const [semesterStudentId, setSemesterStudentId] = useState(null);
+
   useEffect(() => {
-    if (student) {
+    if (student && isOpen) {
       setCurrentSemester(student.current_semester || '1');
-      const currentResults = student.semester_results?.find(sr => sr.semester === (student.current_semester || '1'));
-      if (currentResults) {
-        setSubjects(currentResults.subjects || []);
-      } else {
-        setSubjects(commonSubjects.slice(0, 6).map(name => ({ name, marks: 0, grade: 'F' })));
-      }
+      setSemesterStudentId(student.id);
+      fetchSemesterHistory();
+    } else {
+      setSemesterStudentId(null);
     }
-  }, [student]);
+  }, [student, isOpen]);
+
+  useEffect(() => {
+    if (!student || !isOpen || semesterStudentId !== student.id) return;
+    // Abort on semester change so a slower earlier response cannot land under the new semester
+    const controller = new AbortController();
+    setSubjects([]);
+    fetchSemesterSubjects(currentSemester, controller.signal);
+    return () => controller.abort();
+  }, [student, isOpen, currentSemester, semesterStudentId]);
+
+  const [marksIdempotencyKey, setMarksIdempotencyKey] = useState(newIdempotencyKey);
+
+  useEffect(() => {
+    setMarksIdempotencyKey(newIdempotencyKey());
+  }, [subjects, currentSemester]);
 
   const handleMarksChange = (index, marks) => {
     const newSubjects = [...subjects];
@@ -250,7 +299,8 @@ const StudentModal = ({ student, isOpen, onClose, onUpdate }) => {
       await axios.put(`${API}/students/${student.id}/subjects?user_email=${user.email}`, {
         semester: currentSemester,
         subjects: subjects
-      });
+      }, idempotencyHeaders(marksIdempotencyKey));
+      fetchSemesterHistory();
       onUpdate();
       alert('Marks updated successfully!');
     } catch (error) {
@@ -305,7 +355,7 @@ const StudentModal = ({ student, isOpen, onClose, onUpdate }) => {
               <div className="w-24 h-24 rounded-full overflow-hidden bg-gray-200 flex items-center justify-center">
                 {student.photo ? (
                   <img
-                    src={student.photo}
+                    src={photoSrc(student.photo)}
                     alt={student.name}
                     className="w-full h-full object-cover"
                   />
@@ -325,7 +375,7 @@ const StudentModal = ({ student, isOpen, onClose, onUpdate }) => {
             <div className="mt-6">
               <h4 className="text-lg font-semibold mb-3">Semester History</h4>
               <div className="space-y-2">
-                {student.semester_results?.map((result, index) => (
+                {semesterResults.map((result, index) => (
                   <div key={index} className="p-3 bg-gray-50 rounded-lg">
                     <div className="flex justify-between items-center">
                       <span className="font-medium">Semester {result.semester}</span>
@@ -395,9 +445,17 @@ const StudentModal = ({ student, isOpen, onClose, onUpdate }) => {
             </div>
 
             <div className="flex justify-end space-x-3 mt-6">
+              <a
+                href={`${API}/students/${student.id}/report?format=pdf&semester=${currentSemester}&user_email=${user.email}`}
+                target="_blank"
+                rel="noopener noreferrer"
+                className="px-6 py-2 bg-gray-600 text-white rounded-md hover:bg-gray-700 transition-colors"
+              >
+                Download Report
+              </a>
               <button
                 onClick={handleSaveMarks}
-                disabled={isLoading}
+                disabled={isLoading || subjects.length === 0}
                 className="px-6 py-2 bg-blue-600 text-white rounded-md hover:bg-blue-700 disabled:opacity-50 transition-colors"
               >
                 {isLoading ? 'Saving...' : 'Save Marks'}
@@ -426,7 +484,7 @@ const StudentCard = ({ student, onEdit, onDelete, isAdmin }) => {
           <div className="w-16 h-16 rounded-full overflow-hidden bg-gray-200 flex items-center justify-center">
             {student.photo ? (
               <img
-                src={student.photo}
+                src={photoSrc(student.photo)}
                 alt={student.name}
                 className="w-full h-full object-cover"
               />
@@ -472,7 +530,7 @@ const StudentCard = ({ student, onEdit, onDelete, isAdmin }) => {
 // Main App Component
 const App = () => {
   const [students, setStudents] = useState([]);
-  const [users, setUsers] = useState([]);
+  const [summary, setSummary] = useState(null);
   const [showLoginModal, setShowLoginModal] = useState(false);
   const [showAddStudentModal, setShowAddStudentModal] = useState(false);
   const [showUserManagementModal, setShowUserManagementModal] = useState(false);
@@ -491,25 +549,21 @@ const App = () => {
       console.error('Error fetching students:', error);
     }
     setIsLoading(false);
+    fetchSummary();
   };
 
-  const fetchUsers = async () => {
-    if (!user || user.role !== 'admin') return;
-    
+  const fetchSummary = async () => {
     try {
-      const response = await axios.get(`${API}/users?user_email=${user.email}`);
-      setUsers(response.data);
+      const response = await axios.get(`${API}/dashboard/summary?user_email=${user.email}`);
+      setSummary(response.data);
     } catch (error) {
-      console.error('Error fetching users:', error);
+      console.error('Error fetching dashboard summary:', error);
     }
   };
 
   useEffect(() => {
     if (user) {
       fetchStudents();
-      if (user.role === 'admin') {
-        fetchUsers();
-      }
     }
   }, [user]);
 
@@ -517,23 +571,45 @@ const App = () => {
     if (!window.confirm('Are you sure you want to delete this student?')) return;
     
     try {
-      await axios.delete(`${API}/students/${studentId}?user_email=${user.email}`);
+      const response = await axios.delete(`${API}/students/${studentId}?user_email=${user.email}`);
       fetchStudents();
+      if (window.confirm('Student deleted. Undo?')) {
+        await axios.post(`${API}/deletions/${response.data.deletion_id}/undo?user_email=${user.email}`);
+        fetchStudents();
+      }
     } catch (error) {
       console.error('Error deleting student:', error);
       alert('Failed to delete student');
     }
   };
 
-  const handleAddStudent = async (studentData) => {
+  const handleAddStudent = async (studentData, idempotencyKey) => {
+    const { photoFile, ...fields } = studentData;
+    let student;
     try {
-      await axios.post(`${API}/students?user_email=${user.email}`, studentData);
-      fetchStudents();
-      setShowAddStudentModal(false);
+      const response = await axios.post(`${API}/students?user_email=${user.email}`, fields, idempotencyHeaders(idempotencyKey));
+      student = response.data;
     } catch (error) {
       console.error('Error adding student:', error);
       alert('Failed to add student');
+      return false;
     }
+
+    // The student exists from here on, so a failed photo upload must not keep the form open for a resubmit
+    fetchStudents();
+    setShowAddStudentModal(false);
+    if (photoFile) {
+      try {
+        const body = new FormData();
+        body.append('photo', photoFile);
+        await axios.post(`${API}/students/${student.id}/photo?user_email=${user.email}`, body);
+        fetchStudents();
+      } catch (error) {
+        console.error('Error uploading photo:', error);
+        alert(`Student added, but the photo upload failed: ${error.response?.data?.detail || error.message}`);
+      }
+    }
+    return true;
   };
 
   if (authLoading) {
@@ -618,6 +694,38 @@ const App = () => {
               </button>
             </div>
 
+            {/* Dashboard Summary */}
+            {summary && (
+              <div className="grid grid-cols-1 md:grid-cols-3 gap-6 mb-8">
+                <div className="bg-white rounded-lg shadow p-4">
+                  <p className="text-sm text-gray-500">Students</p>
+                  <p className="text-2xl font-bold text-gray-800">{summary.total_students}</p>
+                </div>
+                {summary.total_users !== undefined && (
+                  <div className="bg-white rounded-lg shadow p-4">
+                    <p className="text-sm text-gray-500">Users</p>
+                    <p className="text-2xl font-bold text-gray-800">{summary.total_users}</p>
+                  </div>
+                )}
+                {summary.recent_activity && (
+                  <div className="bg-white rounded-lg shadow p-4">
+                    <p className="text-sm text-gray-500">Activity (last {summary.recent_activity.window_hours}h)</p>
+                    <p className="text-2xl font-bold text-gray-800">{summary.recent_activity.total}</p>
+                  </div>
+                )}
+                <div className="bg-white rounded-lg shadow p-4 md:col-span-3">
+                  <p className="text-sm text-gray-500 mb-2">Students per Stream</p>
+                  <div className="flex flex-wrap gap-2">
+                    {Object.entries(summary.students_per_stream).map(([stream, count]) => (
+                      <span key={stream} className="px-3 py-1 bg-blue-100 text-blue-800 rounded-full text-sm">
+                        {stream}: {count}
+                      </span>
+                    ))}
+                  </div>
+                </div>
+              </div>
+            )}
+
             {/* Students Grid */}
             {isLoading ? (
               <div className="text-center py-12">
@@ -685,8 +793,6 @@ const App = () => {
       <UserManagementModal
         isOpen={showUserManagementModal}
         onClose={() => setShowUserManagementModal(false)}
-        users={users}
-        onRefresh={fetchUsers}
         currentUser={user}
       />
 
@@ -705,36 +811,41 @@ const AddStudentModal = ({ isOpen, onClose, onAdd }) => {
     name: '',
     roll_number: '',
     stream: '',
-    photo: '',
+    photoFile: null,
     current_semester: '1'
   });
   const [isLoading, setIsLoading] = useState(false);
+  const [idempotencyKey, setIdempotencyKey] = useState(newIdempotencyKey);
+
+  useEffect(() => {
+    setIdempotencyKey(newIdempotencyKey());
+  }, [formData]);
 
   const handleSubmit = async (e) => {
     e.preventDefault();
     setIsLoading(true);
-    await onAdd(formData);
+    const added = await onAdd(formData, idempotencyKey);
     setIsLoading(false);
-    setFormData({
-      name: '',
-      roll_number: '',
-      stream: '',
-      photo: '',
-      current_semester: '1'
-    });
+    // Keep the form (and its key) after a failure so resubmitting is a retry
+    if (added) {
+      setFormData({
+        name: '',
+        roll_number: '',
+        stream: '',
+        photoFile: null,
+        current_semester: '1'
+      });
+    }
   };
 
   const handleImageUpload = (e) => {
+    // Sent as multipart after the student is created, not inlined as base64
     const file = e.target.files[0];
     if (file) {
-      const reader = new FileReader();
-      reader.onload = (e) => {
-        setFormData({
-          ...formData,
-          photo: e.target.result
-        });
-      };
-      reader.readAsDataURL(file);
+      setFormData({
+        ...formData,
+        photoFile: file
+      });
     }
   };
 
@@ -846,9 +957,40 @@ const AddStudentModal = ({ isOpen, onClose, onAdd }) => {
 };
 
 // User Management Modal Component
-const UserManagementModal = ({ isOpen, onClose, users, onRefresh, currentUser }) => {
+const UserManagementModal = ({ isOpen, onClose, currentUser }) => {
+  const [users, setUsers] = useState([]);
+  const [totalUsers, setTotalUsers] = useState(0);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [filters, setFilters] = useState({ email_prefix: '', role: '' });
   const [isLoading, setIsLoading] = useState(false);
 
+  const fetchUsers = async (cursor = null) => {
+    const params = { user_email: currentUser.email, limit: 50 };
+    if (filters.email_prefix) params.email_prefix = filters.email_prefix;
+    if (filters.role) params.role = filters.role;
+
+    try {
+      const [response, countResponse] = await Promise.all([
+        axios.get(`${API}/users`, { params: cursor ? { ...params, cursor } : params }),
+        cursor ? Promise.resolve(null) : axios.get(`${API}/users/count`, { params })
+      ]);
+      setUsers(cursor ? [...users, ...response.data] : response.data);
+      setNextCursor(response.headers['x-next-cursor'] || null);
+      if (countResponse) setTotalUsers(countResponse.data.count);
+    } catch (error) {
+      console.error('Error fetching users:', error);
+    }
+  };
+
+  const onRefresh = () => fetchUsers();
+
+  // Debounced, so typing in the search box sends one request rather than one per keystroke
+  useEffect(() => {
+    if (!isOpen || currentUser?.role !== 'admin') return;
+    const timer = setTimeout(() => fetchUsers(), USER_SEARCH_DEBOUNCE_MS);
+    return () => clearTimeout(timer);
+  }, [isOpen, filters]);
+
   const handleDeleteUser = async (userId) => {
     if (!window.confirm('Are you sure you want to delete this user?')) return;
     
@@ -896,6 +1038,26 @@ const UserManagementModal = ({ isOpen, onClose, users, onRefresh, currentUser })
           </button>
         </div>
 
+        <div className="flex items-center space-x-4 mb-4">
+          <input
+            type="text"
+            placeholder="Search by email prefix"
+            value={filters.email_prefix}
+            onChange={(e) => setFilters({ ...filters, email_prefix: e.target.value })}
+            className="flex-1 px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500"
+          />
+          <select
+            value={filters.role}
+            onChange={(e) => setFilters({ ...filters, role: e.target.value })}
+            className="px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500"
+          >
+            <option value="">All Roles</option>
+            <option value="user">User</option>
+            <option value="admin">Admin</option>
+          </select>
+          <span className="text-sm text-gray-500">{users.length} of {totalUsers} users</span>
+        </div>
+
         <div className="overflow-x-auto">
           <table className="w-full border-collapse border border-gray-300">
             <thead>
@@ -942,6 +1104,17 @@ const UserManagementModal = ({ isOpen, onClose, users, onRefresh, currentUser })
             </tbody>
           </table>
         </div>
+
+        {nextCursor && (
+          <div className="flex justify-center mt-4">
+            <button
+              onClick={() => fetchUsers(nextCursor)}
+              className="px-4 py-2 bg-gray-600 text-white rounded-md hover:bg-gray-700 transition-colors text-sm"
+            >
+              Load More
+            </button>
+          </div>
+        )}
       </div>
     </div>
   );